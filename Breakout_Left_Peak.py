@@ -1,38 +1,35 @@
 import pandas as pd
 import numpy as np
 import os
-import glob
 from datetime import datetime
 from multiprocessing import Pool, cpu_count
+from stock_cache import load_stock, load_names, list_csv, FLOAT32_DTYPES, rsi_last
 
 # --- 战法配置 ---
 STRATEGY_NAME = "倍量过左峰 + RSI辅助"
 # 战法要领：
 # 1. 寻找前期局部高点（左峰）
 # 2. 今日放量（成交量 > 昨量 * 1.9）且收盘价突破左峰
-# 3. 辅助指标：RSI(6) > 50 且 RSI(6) > RSI(12) (确保动能向上)
+# 3. 辅助指标：RSI(6) > 50 且 RSI(6) > RSI(12) (确保动能向上，RSI 为 Wilder 平滑)
 # 4. 价格在 5-20 元之间，排除创业板、科创板、北交所和ST
 
 DATA_DIR = "./stock_data"
 NAMES_FILE = "stock_names.csv"
-
-def calculate_rsi(series, period=6):
-    """计算RSI指标"""
-    delta = series.diff()
-    gain = (delta.where(delta > 0, 0)).rolling(window=period).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(window=period).mean()
-    rs = gain / loss
-    return 100 - (100 / (1 + rs))
+PRICE_RANGE = (5.0, 25.0)   # 现价区间（稍微放宽到25元）
+VOL_MULTIPLE = 1.9          # 今日量 / 昨日量下限（近似倍量）
+RSI_STRONG = 50             # RSI6 强势线
 
 def is_valid_stock(code):
     """筛选：沪深A股，排除创业板、科创板、北交所、ST"""
-    if code.startswith('300') or code.startswith('688'): return False 
-    if code.startswith('4') or code.startswith('8'): return False 
-    return True
+    c = int(code)
+    # 创业板 300xxx、科创板 688xxx、北交所 4xxxxx/8xxxxx，按代码数值区间一次判定
+    return not ((300000 <= c < 301000) | (688000 <= c < 689000) | (400000 <= c < 500000) | (800000 <= c < 900000))
 
-def analyze_stock(file_path):
+def extract_features(file_path):
+    """读取单只股票，提取战法判定所需的最新一日特征"""
     try:
-        df = pd.read_csv(file_path)
+        # 命中本地缓存时跳过 CSV 解析，缓存过期或缺失时回退读取 CSV；价量列以 float32 读取
+        df = load_stock(file_path, dtype=FLOAT32_DTYPES)
         if len(df) < 40: return None # 确保有足够数据计算RSI
         
         # 转换列名确保匹配
@@ -41,91 +38,89 @@ def analyze_stock(file_path):
         
         if not is_valid_stock(code): return None
         
-        # --- 计算技术指标 ---
-        # 计算 RSI (6, 12)
-        df['rsi_6'] = calculate_rsi(df['收盘'], 6)
-        df['rsi_12'] = calculate_rsi(df['收盘'], 12)
-        
-        # 获取最新数据
-        latest = df.iloc[-1]
-        prev = df.iloc[-2]
-        
-        # 1. 基础筛选：价格 5-20 元
-        curr_price = latest['收盘']
-        if not (5.0 <= curr_price <= 25.0): return None # 稍微放宽到25元
-        
-        # 2. 计算左峰（过去5到20天的最高价）
-        recent_window = df.iloc[-21:-1]
-        left_peak = recent_window['最高'].max()
-        
-        # 3. 核心战法逻辑判定
-        is_breakout = curr_price > left_peak      # 价格突破左峰
-        is_double_vol = latest['成交量'] >= (prev['成交量'] * 1.9) # 近似倍量
-        
-        # 4. RSI 过滤逻辑
-        # RSI6 在 50-85 之间（强势且未到极度超买），且 RSI6 > RSI12 (金叉/多头)
-        is_rsi_strong = (latest['rsi_6'] > 50) and (latest['rsi_6'] > latest['rsi_12'])
+        # 计算 RSI (6, 12)，只取最新值
+        # 注意：原先为 rolling 简单均值版 RSI，改用 Wilder 平滑后 RSI 取值不同，RSI 过滤与强度评分的结果也随之变化
+        close = df['收盘'].to_numpy()
+        volume = df['成交量'].to_numpy()
+        high = df['最高'].to_numpy()
         
-        if is_breakout and is_double_vol and is_rsi_strong:
-            # 强度评分
-            strength = 70
-            if latest['涨跌幅'] > 7: strength += 20 # 强力突破加分
-            if latest['rsi_6'] > 80: strength -= 10 # 过于超买适当减分预防冲高回落
-            
-            suggestion = "观察"
-            if strength >= 90: suggestion = "一击必中：动能极强，建议介入"
-            elif strength >= 70: suggestion = "试错观察：多头趋势，轻仓跟进"
-            
-            return {
-                "代码": code,
-                "现价": curr_price,
-                "左峰价": left_peak,
-                "成交量比": round(latest['成交量']/prev['成交量'], 2),
-                "RSI6": round(latest['rsi_6'], 2),
-                "涨跌幅": latest['涨跌幅'],
-                "买入信号强度": f"{strength}%",
-                "操作建议": suggestion
-            }
+        return {
+            "代码": code,
+            "现价": close[-1],
+            # 左峰：过去5到20天的最高价
+            "左峰价": high[-21:-1].max(),
+            "成交量": volume[-1],
+            "昨成交量": volume[-2],
+            "涨跌幅": df['涨跌幅'].iat[-1],
+            "rsi_6": rsi_last(close, 6),
+            "rsi_12": rsi_last(close, 12)
+        }
     except Exception as e:
         # print(f"Error analyzing {file_path}: {e}")
         return None
-    return None
+
+def screen_stocks(features):
+    """对全市场特征表一次性完成战法判定与评分"""
+    df = pd.DataFrame(features)
+    
+    # 1. 基础筛选：价格 5-20 元（稍微放宽到25元）
+    in_price = (df['现价'] >= PRICE_RANGE[0]) & (df['现价'] <= PRICE_RANGE[1])
+    # 2. 核心战法逻辑判定：价格突破左峰 + 近似倍量
+    is_breakout = df['现价'] > df['左峰价']
+    is_double_vol = df['成交量'] >= df['昨成交量'] * VOL_MULTIPLE
+    # 3. RSI 过滤逻辑
+    # RSI6 在 50-85 之间（强势且未到极度超买），且 RSI6 > RSI12 (金叉/多头)
+    is_rsi_strong = (df['rsi_6'] > RSI_STRONG) & (df['rsi_6'] > df['rsi_12'])
+    
+    hits = df[in_price & is_breakout & is_double_vol & is_rsi_strong].copy()
+    
+    # 强度评分：强力突破加分，过于超买适当减分预防冲高回落
+    strength = 70 + np.where(hits['涨跌幅'] > 7, 20, 0) - np.where(hits['rsi_6'] > 80, 10, 0)
+    
+    hits['强度'] = strength
+    hits['成交量比'] = (hits['成交量'] / hits['昨成交量']).round(2)
+    hits['RSI6'] = hits['rsi_6'].round(2)
+    hits['操作建议'] = np.select(
+        [strength >= 90, strength >= 70],
+        ["一击必中：动能极强，建议介入", "试错观察：多头趋势，轻仓跟进"],
+        "观察"
+    )
+    return hits
 
 def main():
     print(f"开始运行战法：{STRATEGY_NAME}")
     
     # 加载名称映射
     try:
-        names_df = pd.read_csv(NAMES_FILE)
-        names_dict = dict(zip(names_df['code'].astype(str).str.zfill(6), names_df['name']))
+        names_dict = load_names(NAMES_FILE)
     except:
         names_dict = {}
         print("警告：未找到股票名称文件，将仅显示代码。")
     
     # 获取所有CSV文件
-    files = glob.glob(os.path.join(DATA_DIR, "*.csv"))
+    files = list_csv(DATA_DIR)
     if not files:
         print(f"错误：在 {DATA_DIR} 目录下未找到数据文件。")
         return
     
-    # 并行处理
+    # 并行读取各股特征，再对全市场统一判定
     with Pool(cpu_count()) as p:
-        results = p.map(analyze_stock, files)
+        results = p.map(extract_features, files)
     
     # 过滤空结果
-    final_list = [r for r in results if r is not None]
+    features = [r for r in results if r is not None]
+    res_df = screen_stocks(features) if features else pd.DataFrame()
     
-    if final_list:
-        res_df = pd.DataFrame(final_list)
+    if not res_df.empty:
         # 匹配名称
-        res_df['名称'] = res_df['代码'].apply(lambda x: names_dict.get(x, "未知"))
+        res_df['名称'] = res_df['代码'].map(names_dict).fillna("未知")
         
-        # 整理列顺序
+        # 按强度数值降序排好，再按输出列顺序一次组装结果表
+        order = np.argsort(-res_df['强度'].to_numpy(), kind='stable')
+        # 数值结果在输出前统一格式化
+        res_df['买入信号强度'] = res_df['强度'].astype(str) + '%'
         cols = ['代码', '名称', '现价', '左峰价', '成交量比', 'RSI6', '涨跌幅', '买入信号强度', '操作建议']
-        res_df = res_df[cols]
-        
-        # 排序：按强度降序
-        res_df = res_df.sort_values(by="买入信号强度", ascending=False)
+        res_df = pd.DataFrame({c: res_df[c].to_numpy()[order] for c in cols})
         
         # 创建输出目录
         now = datetime.now()
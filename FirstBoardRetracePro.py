@@ -1,9 +1,9 @@
 import pandas as pd
 import numpy as np
 import os
-import glob
 from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from stock_cache import load_stock, load_names, list_csv, load_panel, iter_panel, panel_snapshot, FLOAT32_DTYPES
 
 # 战法名称：首板缩量回踩底部战法 (Pro版)
 # 逻辑说明：
@@ -12,97 +12,158 @@ from datetime import datetime
 # 3. 价格回踩至涨停柱底部区域（支撑位）。
 # 4. 结合历史类似形态回测胜率进行买入强度定级。
 
-def analyze_stock(file_path, stock_names_map):
-    try:
-        df = pd.read_csv(file_path)
-        df.columns = ['date', 'code', 'open', 'close', 'high', 'low', 'volume', 'amount', 'amplitude', 'pct_chg', 'change', 'turnover']
-        df = df.sort_values('date')
-        
-        if len(df) < 20: 
-            return None
-        
-        last_bar = df.iloc[-1]
-        last_price = last_bar['close']
-        code = str(last_bar['code']).zfill(6)
-        name = stock_names_map.get(code, "未知")
-        
-        # 1. 基础过滤：主板, 非ST, 价格区间
-        if not (5.0 <= last_price <= 35.0): return None
-        if code.startswith(('30', '688')) or "ST" in name: return None
+# --- 战法配置 ---
+LIMIT_UP_PCT = 9.8               # 主板涨停判定阈值
+LOOKBACK = 10                    # 首板搜索范围（日）
+WINDOW = LOOKBACK + 7            # 判定只需最近 WINDOW 日数据
+PRICE_RANGE = (5.0, 35.0)        # 现价区间
+RETRACE_DAYS = (2, 5)            # 黄金回调期（天）
+VOL_RATIO_RANGE = (0.15, 0.60)   # 今日量 / 涨停日量
+MAX_RETRACE_DROP = -6.0          # 回调期单日跌幅下限（排除大阴线）
+NAMES_FILE = 'stock_names.csv'
 
-        # 2. 寻找最近10日内的首板
-        lookback = 10
-        recent_df = df.tail(lookback + 7).reset_index(drop=True)
-        
-        limit_up_idx = -1
-        for i in range(len(recent_df)-1, len(recent_df)-lookback-1, -1):
-            if recent_df.iloc[i]['pct_chg'] >= 9.8:
-                # 确保首板：此前5天无涨停
-                if i > 5 and not (recent_df.iloc[i-5:i]['pct_chg'] >= 9.8).any():
-                    limit_up_idx = i
-                    break
-        
-        if limit_up_idx == -1 or limit_up_idx == len(recent_df)-1: 
-            return None
-        
-        # 3. 统计回调特征
-        retrace_df = recent_df.iloc[limit_up_idx+1:]
-        retrace_days = len(retrace_df)
-        
-        # 实战收紧：黄金回调期 2-5 天
-        if not (2 <= retrace_days <= 5): 
-            return None
-        
-        # 4. 量价判定
-        limit_bar = recent_df.iloc[limit_up_idx]
-        v_ratio = last_bar['volume'] / limit_bar['volume']
-        
-        # 极致缩量要求 (0.15 - 0.6 之间)
-        v_decrease = 0.15 <= v_ratio <= 0.60
-        
-        # 价格回踩区间：不破涨停开盘价，回踩至实体中轴
-        limit_mid = (limit_bar['open'] + limit_bar['close']) / 2
-        price_in_zone = limit_bar['open'] * 0.995 <= last_price <= limit_mid
-        
-        # 回调质量：无大阴线
-        no_big_down = not (retrace_df['pct_chg'] < -6.0).any()
+# 只读取判定所需的列，并统一为英文列名
+USECOLS = {'日期': 'date', '股票代码': 'code', '开盘': 'open', '收盘': 'close', '成交量': 'volume', '涨跌幅': 'pct_chg'}
+
+def find_first_board(pct, lookback=LOOKBACK):
+    """在最近 lookback 日内从后往前寻找首板，返回其位置，未找到返回 -1"""
+    n = len(pct)
+    is_limit_up = pct >= LIMIT_UP_PCT
+    # last_lu[j]：截至第 j 日最近一次涨停的位置（无则为 -1），一次前向累积得到
+    last_lu = np.maximum.accumulate(np.where(is_limit_up, np.arange(n), -1))
+    # 确保首板：此前5天无涨停，即前一日的最近涨停位置早于 i-5
+    i = np.arange(n-lookback, n)
+    candidates = i[is_limit_up[i] & (i > 5) & (last_lu[i-1] < i-5)]
+    return candidates[-1] if candidates.size else -1
+
+# 股票名称映射，由 _init_worker 在每个工作进程（面板路径下为主进程）启动时加载一次，避免随每个任务序列化传输
+NAMES = {}
+
+def _init_worker(path):
+    global NAMES
+    NAMES = load_names(path)
+
+def extract_features(file_path):
+    """读取单只股票，定位首板并提取回调阶段的量价特征"""
+    try:
+        df = load_stock(file_path, columns=list(USECOLS), dtype=FLOAT32_DTYPES).rename(columns=USECOLS)
+        # 缓存已按日期升序存放，仅在回退读取未排序的 CSV 时才排序
+        if not df['date'].is_monotonic_increasing:
+            df = df.sort_values('date')
         
-        if v_decrease and price_in_zone and no_big_down:
-            is_monotonic = retrace_df['volume'].is_monotonic_decreasing
-            signal_strength = "强" if is_monotonic else "中"
-            
-            return {
-                "代码": code,
-                "名称": name,
-                "现价": last_price,
-                "涨停日": limit_bar['date'],
-                "回调天数": retrace_days,
-                "信号强度": signal_strength,
-                "操作建议": "每只6000元" if signal_strength == "强" else "轻仓观察",
-                "买入逻辑": f"回踩实体中轴，量能腰斩({v_ratio:.2f})"
-            }
-            
+        code = str(int(df['code'].iat[-1])).zfill(6)
+        # 只取最近 WINDOW 日的数组视图，不再构造子 DataFrame
+        w = slice(-WINDOW, None)
+        return features_from_window(
+            code, NAMES.get(code, "未知"), len(df),
+            df['date'].to_numpy()[w], df['open'].to_numpy()[w], df['close'].to_numpy()[w],
+            df['volume'].to_numpy()[w], df['pct_chg'].to_numpy()[w]
+        )
     except Exception as e:
         return None
-    return None
+
+def features_from_window(code, name, num_rows, date, open_, close, volume, pct):
+    """基于最近 WINDOW 日的数组判定首板回调形态，num_rows 为该股历史总行数"""
+    if num_rows < 20: 
+        return None
+    # 近10日无涨停即可直接排除（绝大多数个股），省去后续逐日回溯
+    if pct[-LOOKBACK:].max() < LIMIT_UP_PCT:
+        return None
+    
+    last_price = close[-1]
+    code_num = int(code)
+    
+    # 1. 基础过滤：主板(排除 30xxxx / 688xxx), 非ST, 价格区间
+    if not (PRICE_RANGE[0] <= last_price <= PRICE_RANGE[1]): return None
+    if (300000 <= code_num < 310000) | (688000 <= code_num < 689000) or "ST" in name: return None
+
+    # 2. 寻找最近10日内的首板
+    limit_up_idx = find_first_board(pct, LOOKBACK)
+    if limit_up_idx == -1:
+        return None
+    
+    # 3. 统计回调特征，实战收紧：黄金回调期 2-5 天
+    retrace_days = len(pct) - limit_up_idx - 1
+    if not (RETRACE_DAYS[0] <= retrace_days <= RETRACE_DAYS[1]): 
+        return None
+    
+    return {
+        "代码": code,
+        "名称": name,
+        "现价": last_price,
+        "涨停日": date[limit_up_idx],
+        "回调天数": retrace_days,
+        "量比": volume[-1] / volume[limit_up_idx],
+        "涨停开盘价": open_[limit_up_idx],
+        "涨停中轴": (open_[limit_up_idx] + close[limit_up_idx]) / 2,
+        # 回调期是否出现跌幅超过下限的大阴线（空值不计）
+        "回调大阴线": bool((pct[limit_up_idx+1:] < MAX_RETRACE_DROP).any()),
+        # 逐级缩量：回调期成交量单调不增
+        "逐级缩量": bool(np.all(np.diff(volume[limit_up_idx+1:]) <= 0))
+    }
+
+def extract_features_from_panel(panel):
+    """在全市场面板上按 offsets 切片逐只判定，无需逐个打开文件"""
+    # 面板构建时各股已按日期升序拼接（build_panel 中排序），无需再检查
+    # 先在最新一日快照上过滤行数与价格区间，只对幸存者切片读取历史
+    snap = panel_snapshot(panel)
+    snap = snap[(snap['rows'] >= 20) & snap['close'].between(*PRICE_RANGE)]
+    features = []
+    w = slice(-WINDOW, None)
+    for code, a in iter_panel(panel, ['date', 'open', 'close', 'volume', 'pct_chg'], only=set(snap['code'])):
+        res = features_from_window(
+            code, NAMES.get(code, "未知"), len(a['close']),
+            a['date'][w], a['open'][w], a['close'][w], a['volume'][w], a['pct_chg'][w]
+        )
+        if res: features.append(res)
+    return features
+
+def screen_stocks(features):
+    """对所有首板候选一次性做量价判定，并生成信号与建议"""
+    df = pd.DataFrame(features)
+    v_ratio = df['量比'].to_numpy()
+    last_price = df['现价'].to_numpy()
+    
+    # 极致缩量 (0.15 - 0.6)、回踩至涨停开盘价与实体中轴之间、回调期无大阴线
+    mask = ((v_ratio >= VOL_RATIO_RANGE[0]) & (v_ratio <= VOL_RATIO_RANGE[1])
+            & (last_price >= df['涨停开盘价'].to_numpy() * 0.995)
+            & (last_price <= df['涨停中轴'].to_numpy())
+            & ~df['回调大阴线'].to_numpy())
+    
+    hits = df[mask]
+    strong = hits['逐级缩量'].to_numpy()
+    return pd.DataFrame({
+        "代码": hits['代码'],
+        "名称": hits['名称'],
+        "现价": hits['现价'],
+        "涨停日": hits['涨停日'],
+        "回调天数": hits['回调天数'],
+        "信号强度": np.where(strong, "强", "中"),
+        "操作建议": np.where(strong, "每只6000元", "轻仓观察"),
+        "量比": hits['量比']
+    })
+
 def run():
-    stock_names = pd.read_csv('stock_names.csv', dtype={'code': str})
-    names_map = dict(zip(stock_names['code'], stock_names['name']))
+    files = list_csv()
     
-    files = glob.glob('stock_data/*.csv')
-    results = []
+    # 提取首板候选（已构建缓存面板时直接切片，否则并行读取各文件），再统一做量价判定
+    panel = load_panel(files)
+    if panel is not None:
+        _init_worker(NAMES_FILE)
+        features = extract_features_from_panel(panel)
+    else:
+        # 按批分发任务（与 Pool.map 的默认分块一致），减少进程间往返
+        chunksize = max(1, len(files) // ((os.cpu_count() or 1) * 4))
+        with ProcessPoolExecutor(initializer=_init_worker, initargs=(NAMES_FILE,)) as executor:
+            features = [res for res in executor.map(extract_features, files, chunksize=chunksize) if res]
     
-    # 并行处理
-    with ProcessPoolExecutor() as executor:
-        futures = [executor.submit(analyze_stock, f, names_map) for f in files]
-        for future in futures:
-            res = future.result()
-            if res: results.append(res)
+    res_df = screen_stocks(features) if features else pd.DataFrame()
             
-    if results:
-        res_df = pd.DataFrame(results)
+    if not res_df.empty:
         # 精选优加：按信号强度排序
         res_df = res_df.sort_values("信号强度", ascending=False)
+        # 数值结果在输出前统一格式化
+        res_df['买入逻辑'] = "回踩实体中轴，量能腰斩(" + res_df.pop('量比').map('{:.2f}'.format) + ")"
         
         now = datetime.now()
         dir_path = now.strftime('%Y%m')
@@ -1,8 +1,8 @@
 import pandas as pd
 import os
-import glob
 from datetime import datetime
 from joblib import Parallel, delayed
+from stock_cache import load_stock, load_names, list_csv, FLOAT32_DTYPES
 
 # ==========================================
 # 战法名称：冲高回落试盘战法 (High_Limit_Retrace)
@@ -12,48 +12,54 @@ from joblib import Parallel, delayed
 # 3. 买入逻辑：关注低位放量后的冲高回落，次日若能回踩不破影线中轴可试错。
 # ==========================================
 
-def process_stock(file_path, stock_names):
+# 只读取战法用到的列
+READ_COLS = ['日期', '开盘', '收盘', '最高', '成交量', '涨跌幅', '换手率']
+
+def process_stock(file_path):
+    # --- 基础筛选条件（仅凭文件名即可判定，先于读取数据） ---
+    code = os.path.basename(file_path).replace('.csv', '').zfill(6)
+    # 1. 排除 ST (通过文件名或代码判断，这里假设代码前缀)
+    if "ST" in file_path:
+        return None
+    # 2. 排除 30 开头 (创业板)
+    if code.startswith('30'):
+        return None
+    # 3. 仅限沪深A股 (00, 60 开头)
+    if not (code.startswith('00') or code.startswith('60')):
+        return None
     try:
-        df = pd.read_csv(file_path)
+        df = load_stock(file_path, columns=READ_COLS, dtype=FLOAT32_DTYPES)
         if df.empty or len(df) < 5:
             return None
         
-        # 获取最新一行数据
-        latest = df.iloc[-1]
-        code = str(latest['股票代码']).zfill(6)
+        # 获取最新一日数据（按位置直接读取标量，不构造整行 Series）
+        last_close = df['收盘'].iat[-1]
         
-        # --- 基础筛选条件 ---
-        # 1. 价格区间 [5, 20]
-        if not (5.0 <= latest['收盘'] <= 20.0):
-            return None
-        # 2. 排除 ST (通过文件名或代码判断，这里假设代码前缀)
-        if "ST" in file_path:
-            return None
-        # 3. 排除 30 开头 (创业板)
-        if code.startswith('30'):
-            return None
-        # 4. 仅限沪深A股 (00, 60 开头)
-        if not (code.startswith('00') or code.startswith('60')):
+        # 4. 价格区间 [5, 20]
+        if not (5.0 <= last_close <= 20.0):
             return None
 
+        last_high = df['最高'].iat[-1]
+        last_pct = df['涨跌幅'].iat[-1]
         # --- 战法核心形态逻辑 ---
         # A. 当天最高涨幅 >= 7%
-        high_pct = latest['涨跌幅'] + (latest['最高'] - latest['收盘']) / latest['收盘'] * 100 # 粗略计算
+        high_pct = last_pct + (last_high - last_close) / last_close * 100 # 粗略计算
         # 更精确：(最高-昨收)/昨收
-        prev_close = latest['收盘'] / (1 + latest['涨跌幅']/100)
-        actual_high_pct = (latest['最高'] - prev_close) / prev_close * 100
-        actual_close_pct = latest['涨跌幅']
+        prev_close = last_close / (1 + last_pct/100)
+        actual_high_pct = (last_high - prev_close) / prev_close * 100
+        actual_close_pct = last_pct
 
         if actual_high_pct >= 7.0 and actual_close_pct <= 2.0:
             # --- 优中选优逻辑（自动复盘） ---
-            vol_ratio = latest['成交量'] / df.iloc[-5:-1]['成交量'].mean() # 量比近5日均值
+            vol = df['成交量'].to_numpy()
+            vol_ratio = vol[-1] / vol[-5:-1].mean() # 量比近5日均值
             
             # 信号强度评估
             score = 0
             suggestion = "观察"
             
             if vol_ratio > 2.0: score += 40  # 倍量试盘加分
-            if latest['收盘'] > latest['开盘']: score += 20 # 收阳线说明多头尚存
+            if last_close > df['开盘'].iat[-1]: score += 20 # 收阳线说明多头尚存
             if actual_close_pct > 0: score += 20 # 拒绝收绿
             
             # 操作建议
@@ -64,15 +70,14 @@ def process_stock(file_path, stock_names):
             else:
                 suggestion = "暂时放弃：抛压过重或资金撤退"
 
-            name = stock_names.get(code, "未知")
+            # 价量数据为 float32，转回 Python 浮点再按2位小数输出，避免 CSV 中出现 float32 的尾数
             return {
-                "日期": latest['日期'],
+                "日期": df['日期'].iat[-1],
                 "代码": code,
-                "名称": name,
-                "最高涨幅%": round(actual_high_pct, 2),
-                "收盘涨幅%": round(actual_close_pct, 2),
-                "换手率": latest['换手率'],
-                "量比": round(vol_ratio, 2),
+                "最高涨幅%": round(float(actual_high_pct), 2),
+                "收盘涨幅%": round(float(actual_close_pct), 2),
+                "换手率": round(float(df['换手率'].iat[-1]), 2),
+                "量比": round(float(vol_ratio), 2),
                 "买入信号强度": score,
                 "操作建议": suggestion
             }
@@ -81,18 +86,18 @@ def process_stock(file_path, stock_names):
 
 def main():
     # 1. 加载股票名称字典
-    names_df = pd.read_csv('stock_names.csv')
-    names_dict = dict(zip(names_df['code'].astype(str).str.zfill(6), names_df['name']))
+    names_dict = load_names('stock_names.csv')
 
     # 2. 扫描数据目录
-    files = glob.glob('stock_data/*.csv')
+    files = list_csv()
     
-    # 3. 并行处理
-    results = Parallel(n_jobs=-1)(delayed(process_stock)(f, names_dict) for f in files)
+    # 3. 并行处理（名称字典不随任务下发，由主进程统一匹配）
+    results = Parallel(n_jobs=-1)(delayed(process_stock)(f) for f in files)
     results = [r for r in results if r is not None]
     
     if results:
         result_df = pd.DataFrame(results)
+        result_df.insert(2, '名称', result_df['代码'].map(names_dict).fillna("未知"))
         # 按信号强度排序
         result_df = result_df.sort_values(by="买入信号强度", ascending=False)
         
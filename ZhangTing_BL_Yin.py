@@ -1,9 +1,9 @@
 import pandas as pd
 import numpy as np
 import os
-import glob
 from datetime import datetime
 from concurrent.futures import ProcessPoolExecutor
+from stock_cache import load_stock, load_names, list_csv, load_panel, iter_panel, panel_snapshot, PANEL_COLUMNS, FLOAT32_DTYPES
 
 # ==========================================
 # 战法名称：涨停倍量阴·强势洗盘擒龙战法
@@ -19,46 +19,72 @@ DATA_DIR = "stock_data"
 NAMES_FILE = "stock_names.csv"
 PRICE_MIN = 5.0
 PRICE_MAX = 20.0
+# 只读取战法用到的列
+READ_COLS = ['日期', '开盘', '收盘', '最高', '成交量', '涨跌幅']
 
 def analyze_stock(file_path):
+    # 先按文件名中的代码排除创业板(30)，被排除的股票无需读取数据
+    code = os.path.basename(file_path).replace(".csv", "")
+    if code.startswith('30'): return None
+    try:
+        df = load_stock(file_path, columns=READ_COLS, dtype=FLOAT32_DTYPES)
+    except Exception as e:
+        return None
+    return analyze_frame(code, df)
+
+def analyze_panel(panel):
+    """在全市场面板上按 offsets 切片逐只判定，无需逐个打开文件"""
+    # 先在最新一日快照上过滤行数与价格，只对幸存者切片读取历史
+    snap = panel_snapshot(panel)
+    snap = snap[(snap['rows'] >= 20) & snap['close'].between(PRICE_MIN, PRICE_MAX)]
+    return [
+        analyze_frame(code, pd.DataFrame({c: a[PANEL_COLUMNS[c]] for c in READ_COLS}))
+        for code, a in iter_panel(panel, [PANEL_COLUMNS[c] for c in READ_COLS], only=set(snap['code']))
+        if not code.startswith('30')
+    ]
+
+def analyze_frame(code, df):
+    """对单只股票的日线数据执行战法判定，代码已由调用方过滤"""
     try:
-        df = pd.read_csv(file_path)
         if len(df) < 20: return None
         
-        # 基础数据预处理
-        code = os.path.basename(file_path).replace(".csv", "")
-        
-        # 1. 基础过滤：排除ST(假设名称中含ST，需配合names文件), 创业板(30), 价格区间
-        if code.startswith('30'): return None
+        # 各列取出一次 NumPy 数组，逐日条件直接在数组上计算
+        o, c, h, vol, pct = (df[col].to_numpy() for col in ('开盘', '收盘', '最高', '成交量', '涨跌幅'))
         
-        last_close = df.iloc[-1]['收盘']
+        # 1. 基础过滤：价格区间（创业板已在读取前排除）
+        last_close = c[-1]
         if not (PRICE_MIN <= last_close <= PRICE_MAX): return None
 
         # 2. 战法逻辑计算
         # 计算涨停板 (涨幅 > 9.8%)
-        df['is_zt'] = (df['涨跌幅'] >= 9.8) & (df['收盘'] == df['最高'])
+        is_zt = (pct >= 9.8) & (c == h)
         
         # 查找最近15天的倍量阴线条件
-        # BLY_CONDI: 前日涨停 + 今日阴线 + 成交量>=2倍前日
-        df['vol_ratio'] = df['成交量'] / df['成交量'].shift(1)
-        df['is_bly'] = (df['is_zt'].shift(1)) & (df['收盘'] < df['开盘']) & (df['vol_ratio'] >= 1.9)
+        # BLY_CONDI: 前日涨停 + 今日阴线 + 成交量>=2倍前日（首日无前日，量比记为 NaN）
+        vol_ratio = np.full_like(vol, np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            np.divide(vol[1:], vol[:-1], out=vol_ratio[1:])
+        is_bly = np.concatenate(([False], is_zt[:-1])) & (c < o) & (vol_ratio >= 1.9)
         
-        # 检查最近15日内是否存在符合条件的倍量阴线
-        recent_df = df.tail(15).copy()
-        if not recent_df['is_bly'].any(): return None
+        # 检查最近15日内是否存在符合条件的倍量阴线：对反转窗口做一次 argmax 定位最近一根，
+        # 窗口内全无信号时 argmax 落在首位，核对该位即可判定
+        recent_bly = is_bly[-15:]
+        last = len(recent_bly) - 1 - np.argmax(recent_bly[::-1])
+        if not recent_bly[last]: return None
         
         # 获取最近那个倍量阴线的价格位置
-        bly_idx = recent_df[recent_df['is_bly']].index[-1]
-        bly_high = df.loc[bly_idx, '最高']
-        bly_open = df.loc[bly_idx, '开盘']
+        bly_idx = len(c) - len(recent_bly) + last
+        bly_high = h[bly_idx]
+        bly_open = o[bly_idx]
         
         # 3. 买入信号判定：当前收盘价重新站上阴线高点/开盘价，且当前是阳线
-        current_price = df.iloc[-1]['收盘']
-        current_open = df.iloc[-1]['开盘']
+        current_price = c[-1]
+        current_open = o[-1]
         
         if current_price > max(bly_high, bly_open) and current_price > current_open:
-            # 辅助指标：缩量金坑（洗盘期间成交量萎缩）
-            vol_check = df.loc[bly_idx+1 : len(df)-2, '成交量'].mean() < df.loc[bly_idx, '成交量'] * 0.5
+            # 辅助指标：缩量金坑（洗盘期间成交量萎缩），阴线次日至昨日无数据时不成立
+            wash_vol = vol[bly_idx+1:-1]
+            vol_check = wash_vol.size > 0 and wash_vol.mean() < vol[bly_idx] * 0.5
             
             # 强度评估
             strength = "极强" if vol_check else "标准"
@@ -69,25 +95,32 @@ def analyze_stock(file_path):
                 "当前价": current_price,
                 "信号强度": strength,
                 "操作建议": advice,
-                "逻辑说明": f"已收复{df.loc[bly_idx, '日期']}的倍量阴线"
+                "逻辑说明": f"已收复{df['日期'].iat[bly_idx]}的倍量阴线"
             }
     except Exception as e:
         return None
 
 def main():
     # 匹配名称
-    names_df = pd.read_csv(NAMES_FILE)
-    names_dict = dict(zip(names_df['code'].astype(str), names_df['name']))
+    names_dict = load_names(NAMES_FILE)
     
-    csv_files = glob.glob(os.path.join(DATA_DIR, "*.csv"))
+    csv_files = list_csv(DATA_DIR)
+    
+    # 已构建缓存面板时直接切片扫描全市场，否则并行读取各文件
+    panel = load_panel(csv_files)
+    if panel is not None:
+        hits = analyze_panel(panel)
+    else:
+        # 按批分发任务（与 Pool.map 的默认分块一致），减少进程间往返
+        chunksize = max(1, len(csv_files) // ((os.cpu_count() or 1) * 4))
+        with ProcessPoolExecutor() as executor:
+            hits = list(executor.map(analyze_stock, csv_files, chunksize=chunksize))
     
-    # 并行处理
     results = []
-    with ProcessPoolExecutor() as executor:
-        for res in executor.map(analyze_stock, csv_files):
-            if res:
-                res['名称'] = names_dict.get(res['代码'], "未知")
-                results.append(res)
+    for res in hits:
+        if res:
+            res['名称'] = names_dict.get(res['代码'], "未知")
+            results.append(res)
     
     # 优中选优：按信号强度排序
     if results:
@@ -1,8 +1,12 @@
 import pandas as pd
 import numpy as np
 import os
+import logging
+import pickle
 from datetime import datetime
 from multiprocessing import Pool, cpu_count
+from numpy.lib.stride_tricks import sliding_window_view
+from stock_cache import load_stock, load_names, list_csv, load_panel, iter_panel, panel_snapshot, PANEL_COLUMNS, FLOAT32_DTYPES
 
 # --- 战法配置区 ---
 STRATEGY_NAME = "突破回踩一击必中"
@@ -10,61 +14,82 @@ PRICE_MIN = 5.0
 PRICE_MAX = 20.0
 DATA_DIR = "stock_data"
 NAMES_FILE = "stock_names.csv"
+# 只读取战法用到的列
+READ_COLS = ['日期', '收盘', '成交量', '涨跌幅', '换手率']
+
+def is_excluded(code):
+    # 排除 30 (创业板) 和 ST (通常文件名或数据内含)
+    return code.startswith('30') or "ST" in code
 
 def analyze_stock(file_path):
     """
     单只股票战法逻辑分析
     """
+    code = os.path.basename(file_path).split('.')[0]
+    if is_excluded(code):
+        return None
+    try:
+        df = load_stock(file_path, columns=READ_COLS, dtype=FLOAT32_DTYPES)
+    except (OSError, EOFError, ValueError, KeyError, pickle.UnpicklingError) as e:
+        # 只跳过文件缺失/损坏、列缺失等数据问题，代码错误直接抛出
+        logging.warning("跳过 %s: %s", file_path, e)
+        return None
+    return analyze_frame(code, df)
+
+def analyze_panel(panel):
+    """在全市场面板上按 offsets 切片逐只判定，无需逐个打开文件"""
+    # 先在最新一日快照上过滤行数与价格，只对幸存者切片读取历史
+    snap = panel_snapshot(panel)
+    snap = snap[(snap['rows'] >= 30) & snap['close'].between(PRICE_MIN, PRICE_MAX)]
+    return [
+        analyze_frame(code, pd.DataFrame({c: a[PANEL_COLUMNS[c]] for c in READ_COLS}))
+        for code, a in iter_panel(panel, [PANEL_COLUMNS[c] for c in READ_COLS], only=set(snap['code']))
+        if not is_excluded(code)
+    ]
+
+def analyze_frame(code, df):
+    """对单只股票的日线数据执行战法判定，代码已由调用方过滤"""
     try:
-        code = os.path.basename(file_path).split('.')[0]
-        
-        # 排除 30 (创业板) 和 ST (通常文件名或数据内含)
-        if code.startswith('30') or "ST" in code:
-            return None
-        
-        df = pd.read_csv(file_path)
         if len(df) < 30: return None
         
-        # 按照日期排序确保逻辑正确
-        df = df.sort_values('日期')
-        last_row = df.iloc[-1]
+        # 按照日期排序确保逻辑正确；缓存与面板已按日期升序存放，仅在回退读取未排序的 CSV 时才排序
+        if not df['日期'].is_monotonic_increasing:
+            df = df.sort_values('日期')
+        
+        # 各列取出一次 NumPy 数组，最新一日数值直接按位置读取
+        close, vol, pct = (df[col].to_numpy() for col in ('收盘', '成交量', '涨跌幅'))
+        close_price, last_vol, last_pct = close[-1], vol[-1], pct[-1]
+        last_turnover = df['换手率'].iat[-1]
         
         # 1. 基础条件过滤
-        close_price = last_row['收盘']
         if not (PRICE_MIN <= close_price <= PRICE_MAX):
             return None
 
         # 2. 战法逻辑计算
-        # 计算均线
-        df['MA10'] = df['收盘'].rolling(10).mean()
-        df['MA20'] = df['收盘'].rolling(20).mean()
-        df['VOL_MA5'] = df['成交量'].rolling(5).mean()
-        
-        curr_close = last_row['收盘']
-        curr_ma10 = last_row['MA10']
+        # 只计算判定用到的均线值（按 float64 累加，与 rolling 一致），不对全序列做 rolling
+        curr_ma10 = close[-10:].mean(dtype=np.float64)
+        curr_ma20 = close[-20:].mean(dtype=np.float64)
+        # 近10日各自的5日均量：第 j 个对应倒数第 10-j 日
+        vol_ma5 = sliding_window_view(vol[-14:], 5).mean(axis=1, dtype=np.float64)
         
-        # A. 寻找近期（5-10天内）是否有强力突破（涨幅>7% 且放量）
-        recent_window = df.iloc[-10:-2]
-        breakout_day = recent_window[(recent_window['涨跌幅'] > 7) & (recent_window['成交量'] > recent_window['VOL_MA5'] * 1.5)]
-        
-        if breakout_day.empty:
+        # A. 寻找近期（5-10天内）是否有强力突破（涨幅>7% 且放量），整段窗口一次性做布尔判定
+        is_breakout_day = (pct[-10:-2] > 7) & (vol[-10:-2] > vol_ma5[:-2] * 1.5)
+        if not is_breakout_day.any():
             return None
             
         # B. 回踩逻辑：当前价格靠近MA10或MA20，且近期成交量萎缩
-        is_retracting = last_row['成交量'] < last_row['VOL_MA5']
-        near_support = abs(curr_close - curr_ma10) / curr_ma10 < 0.02 # 距离均线2%以内
+        is_retracting = last_vol < vol_ma5[-1]
+        near_support = abs(close_price - curr_ma10) / curr_ma10 < 0.02 # 距离均线2%以内
         
         if not (is_retracting and near_support):
             return None
 
-        # 3. 评分系统：优中选优
-        score = 0
+        # 3. 评分系统：优中选优，各项条件按权重直接累加
+        score = int(20 * (last_pct > 0)          # 回踩当日收阳
+                    + 30 * (last_turnover < 5)   # 缩量回踩，主力未出
+                    + 20 * (close_price > curr_ma20))  # 趋势未破
         advice = "观察"
         
-        if last_row['涨跌幅'] > 0: score += 20 # 回踩当日收阳
-        if last_row['换手率'] < 5: score += 30 # 缩量回踩，主力未出
-        if curr_close > last_row['MA20']: score += 20 # 趋势未破
-        
         if score >= 60:
             advice = "试错（轻仓进场）"
         if score >= 80:
@@ -73,25 +98,29 @@ def analyze_stock(file_path):
         return {
             "代码": code,
             "收盘价": close_price,
-            "涨跌幅": last_row['涨跌幅'],
+            "涨跌幅": last_pct,
             "信号强度": f"{score}%",
             "操作建议": advice,
             "战法描述": "放量大阳后缩量回调至支撑位"
         }
-    except Exception as e:
+    except (ValueError, KeyError, IndexError) as e:
+        logging.warning("跳过 %s: %s", code, e)
         return None
 
 def main():
     # 读取名称映射
-    names_df = pd.read_csv(NAMES_FILE)
-    names_dict = dict(zip(names_df['code'].astype(str), names_df['name']))
+    names_dict = load_names(NAMES_FILE)
     
     # 获取所有待处理文件
-    files = [os.path.join(DATA_DIR, f) for f in os.listdir(DATA_DIR) if f.endswith('.csv')]
+    files = list_csv(DATA_DIR)
     
-    # 并行处理
-    with Pool(cpu_count()) as p:
-        results = p.map(analyze_stock, files)
+    # 已构建缓存面板时直接切片扫描全市场，否则并行读取各文件
+    panel = load_panel(files)
+    if panel is not None:
+        results = analyze_panel(panel)
+    else:
+        with Pool(cpu_count()) as p:
+            results = p.map(analyze_stock, files)
     
     # 过滤空结果
     results = [r for r in results if r is not None]
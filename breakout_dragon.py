@@ -1,9 +1,11 @@
 import pandas as pd
 import numpy as np
 import os
-import glob
+import logging
+import pickle
 from datetime import datetime
 import multiprocessing as mp
+from stock_cache import load_stock, load_names, list_csv, load_panel, iter_panel, panel_snapshot, PANEL_COLUMNS, FLOAT32_DTYPES
 
 """
 战法名称：破晓龙回头 (Breakout Dragon System)
@@ -13,42 +15,73 @@ import multiprocessing as mp
 3. 复盘要领：只做突破瞬间。若换手率过高则谨防诱多，若成交量不足则视为假突破。
 """
 
+# 只读取战法用到的列
+READ_COLS = ['日期', '收盘', '最高', '成交量', '涨跌幅', '换手率']
+
+def screen_code(code, name_dict):
+    """按代码与名称做硬性过滤（无需读取数据），通过时返回名称，否则返回 None"""
+    if code.startswith('30'): return None  # 排除创业板
+    stock_name = name_dict.get(code, "未知")
+    if "ST" in stock_name: return None     # 排除ST
+    return stock_name
+
 def analyze_stock(file_path, name_dict):
+    # 1. 排除规则：先按文件名中的代码过滤，被排除的股票无需读取数据
+    code = os.path.basename(file_path).replace('.csv', '')
+    stock_name = screen_code(code, name_dict)
+    if stock_name is None: return None
+    try:
+        df = load_stock(file_path, columns=READ_COLS, dtype=FLOAT32_DTYPES)
+    except (OSError, EOFError, ValueError, KeyError, pickle.UnpicklingError) as e:
+        # 只跳过文件缺失/损坏、列缺失等数据问题，代码错误直接抛出
+        logging.warning("跳过 %s: %s", file_path, e)
+        return None
+    return analyze_frame(code, stock_name, df)
+
+def analyze_panel(panel, name_dict):
+    """在全市场面板上按 offsets 切片逐只判定，无需逐个打开文件"""
+    # 先在最新一日快照上过滤行数与价格，只对幸存者切片读取历史
+    snap = panel_snapshot(panel)
+    snap = snap[(snap['rows'] >= 30) & snap['close'].between(5.0, 20.0)]
+    results = []
+    for code, a in iter_panel(panel, [PANEL_COLUMNS[c] for c in READ_COLS], only=set(snap['code'])):
+        stock_name = screen_code(code, name_dict)
+        if stock_name is not None:
+            results.append(analyze_frame(code, stock_name, pd.DataFrame({c: a[PANEL_COLUMNS[c]] for c in READ_COLS})))
+    return results
+
+def analyze_frame(code, stock_name, df):
+    """对通过代码过滤的单只股票日线数据执行战法判定"""
     try:
-        df = pd.read_csv(file_path)
         if df.empty or len(df) < 30: return None
         
-        # 基础数据清洗
-        df = df.sort_values('日期')
-        code = os.path.basename(file_path).replace('.csv', '')
+        # 基础数据清洗：缓存与面板已按日期升序存放，仅在回退读取未排序的 CSV 时才排序
+        if not df['日期'].is_monotonic_increasing:
+            df = df.sort_values('日期')
         
-        # 1. 排除规则
-        if code.startswith('30'): return None  # 排除创业板
-        stock_name = name_dict.get(code, "未知")
-        if "ST" in stock_name: return None     # 排除ST
-        
-        last_row = df.iloc[-1]
-        close_price = last_row['收盘']
+        # 各列取出一次 NumPy 数组，最新一日数值直接按位置读取
+        close_price = df['收盘'].iat[-1]
         
         # 2. 价格区间限制 (5.0 - 20.0)
         if not (5.0 <= close_price <= 20.0): return None
         
         # --- 战法核心计算 ---
         # 计算过去20天的压力位（最高价的均值或局部高点）
-        history = df.iloc[-21:-1]
-        pressure_line = history['最高'].max()
-        avg_volume = history['成交量'].mean()
+        vol = df['成交量'].to_numpy()
+        pressure_line = df['最高'].to_numpy()[-21:-1].max()
+        avg_volume = vol[-21:-1].mean()
+        last_pct, last_turnover = df['涨跌幅'].iat[-1], df['换手率'].iat[-1]
         
         # 突破逻辑：收盘价高于前20日最高价，且涨幅大于3%
-        is_breakout = close_price > pressure_line and last_row['涨跌幅'] > 3.0
+        is_breakout = close_price > pressure_line and last_pct > 3.0
         # 量能逻辑：今日成交量需是过去20日平均量的1.5倍以上
-        volume_ratio = last_row['成交量'] / avg_volume if avg_volume > 0 else 0
+        volume_ratio = vol[-1] / avg_volume if avg_volume > 0 else 0
         
         if is_breakout and volume_ratio > 1.5:
             # 评估买入强度
             strength = 0
-            if last_row['换手率'] > 5: strength += 40
-            if last_row['涨跌幅'] > 7: strength += 30
+            if last_turnover > 5: strength += 40
+            if last_pct > 7: strength += 30
             if volume_ratio > 2.5: strength += 30
             
             # 操作建议逻辑
@@ -61,36 +94,40 @@ def analyze_stock(file_path, name_dict):
                 suggestion = "【观察等待】虽有突破但力度一般，建议加入自选观察回踩。"
                 
             return {
-                "日期": last_row['日期'],
+                "日期": df['日期'].iat[-1],
                 "代码": code,
                 "名称": stock_name,
                 "收盘价": close_price,
-                "涨跌幅": last_row['涨跌幅'],
+                "涨跌幅": last_pct,
                 "成交倍率": round(volume_ratio, 2),
-                "换手率": last_row['换手率'],
-                "买入信号强度": f"{strength}%",
+                "换手率": last_turnover,
+                "买入信号强度": strength,
                 "操作建议": suggestion
             }
-    except Exception as e:
+    except (ValueError, KeyError, IndexError) as e:
+        logging.warning("跳过 %s: %s", code, e)
         return None
     return None
 
 def main():
     # 加载股票名称
     try:
-        names_df = pd.read_csv('stock_names.csv')
-        # 确保代码格式为字符串并补齐6位
-        names_df['code'] = names_df['code'].astype(str).str.zfill(6)
-        name_dict = dict(zip(names_df['code'], names_df['name']))
-    except:
+        name_dict = load_names()
+    except (OSError, EOFError, ValueError, KeyError, pickle.UnpicklingError):
+        # 名称文件缺失或损坏时仅显示代码
         name_dict = {}
 
     # 并行扫描目录
-    stock_files = glob.glob('stock_data/*.csv')
+    stock_files = list_csv('stock_data')
     print(f"开始扫描 {len(stock_files)} 个数据文件...")
     
-    with mp.Pool(processes=mp.cpu_count()) as pool:
-        results = pool.starmap(analyze_stock, [(f, name_dict) for f in stock_files])
+    # 已构建缓存面板时直接切片扫描全市场，否则并行读取各文件
+    panel = load_panel(stock_files)
+    if panel is not None:
+        results = analyze_panel(panel, name_dict)
+    else:
+        with mp.Pool(processes=mp.cpu_count()) as pool:
+            results = pool.starmap(analyze_stock, [(f, name_dict) for f in stock_files])
     
     # 过滤空结果
     final_list = [r for r in results if r is not None]
@@ -98,8 +135,9 @@ def main():
     # 结果处理
     if final_list:
         output_df = pd.DataFrame(final_list)
-        # 按强度排序
+        # 按强度数值排序后再格式化为百分比，避免 "100%" 按字符串排在 "40%" 之后
         output_df = output_df.sort_values("买入信号强度", ascending=False)
+        output_df['买入信号强度'] = output_df['买入信号强度'].astype(str) + '%'
         
         # 创建年月目录
         now = datetime.now()
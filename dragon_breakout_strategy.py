@@ -1,9 +1,12 @@
 import pandas as pd
 import numpy as np
 import os
-import glob
+import logging
+import pickle
+import heapq
 from datetime import datetime
 import concurrent.futures
+from stock_cache import load_stock, load_names, list_csv, load_panel, iter_panel, panel_snapshot, PANEL_COLUMNS, FLOAT32_DTYPES
 
 # ==========================================
 # 战法名称：龙回头蓄势突破战法
@@ -17,52 +20,82 @@ import concurrent.futures
 STRATEGY_NAME = "dragon_breakout_strategy"
 DATA_DIR = "./stock_data"
 NAMES_FILE = "stock_names.csv"
+# 只读取战法用到的列
+READ_COLS = ['日期', '收盘', '成交量', '涨跌幅', '换手率']
 OUTPUT_DIR_BASE = datetime.now().strftime("%Y-%m")
 
-def analyze_stock(file_path, name_map):
+# 股票名称映射，由 _init_worker 在每个工作进程（面板路径下为主进程）启动时设置一次，避免随每个任务序列化传输
+NAME_MAP = {}
+
+def _init_worker(name_map):
+    global NAME_MAP
+    NAME_MAP = name_map
+
+def screen_code(code):
+    """按代码与名称做硬性过滤（无需读取数据），通过时返回名称，否则返回 None"""
+    # 排除 30 开头 (创业板) 和 排除 ST (通过名称判断，需结合name_map)
+    if code.startswith('30'):
+        return None
+    name = NAME_MAP.get(code, "未知")
+    if "ST" in name or "*" in name:
+        return None
+    return name
+
+def analyze_stock(file_path):
+    # 基础属性过滤：文件名即股票代码，被排除的股票无需读取数据
+    code = os.path.basename(file_path).replace('.csv', '').zfill(6)
+    name = screen_code(code)
+    if name is None:
+        return None
     try:
-        df = pd.read_csv(file_path)
-        if df.empty or len(df) < 130:  # 确保有足够计算均线的数据
-            return None
-        
-        # 基础属性过滤
-        code = str(df['股票代码'].iloc[-1]).zfill(6)
-        # 排除 30 开头 (创业板) 和 排除 ST (通过名称判断，需结合name_map)
-        if code.startswith('30'):
+        df = load_stock(file_path, columns=READ_COLS, dtype=FLOAT32_DTYPES)
+    except (OSError, EOFError, ValueError, KeyError, pickle.UnpicklingError) as e:
+        # 只跳过文件缺失/损坏、列缺失等数据问题，代码错误直接抛出
+        logging.warning("跳过 %s: %s", file_path, e)
+        return None
+    return analyze_frame(code, name, df)
+
+def analyze_panel(panel):
+    """在全市场面板上按 offsets 切片逐只判定，无需逐个打开文件"""
+    # 先在最新一日快照上过滤行数与价格，只对幸存者切片读取历史
+    snap = panel_snapshot(panel)
+    snap = snap[(snap['rows'] >= 130) & snap['close'].between(5.0, 20.0)]
+    results = []
+    for code, a in iter_panel(panel, [PANEL_COLUMNS[c] for c in READ_COLS], only=set(snap['code'])):
+        name = screen_code(code)
+        if name is not None:
+            results.append(analyze_frame(code, name, pd.DataFrame({c: a[PANEL_COLUMNS[c]] for c in READ_COLS})))
+    return results
+
+def analyze_frame(code, name, df):
+    """对通过代码过滤的单只股票日线数据执行战法判定"""
+    try:
+        if len(df) < 130:  # 确保有足够计算均线的数据
             return None
         
-        name = name_map.get(code, "未知")
-        if "ST" in name or "*" in name:
-            return None
-
-        # 最新指标
-        last_close = df['收盘'].iloc[-1]
-        last_pct_change = df['涨跌幅'].iloc[-1]
-        last_turnover = df['换手率'].iloc[-1]
-        last_vol = df['成交量'].iloc[-1]
+        # 最新指标：各列取出一次 NumPy 数组，直接按位置读取
+        close, vol = df['收盘'].to_numpy(), df['成交量'].to_numpy()
+        last_close, last_vol = close[-1], vol[-1]
+        last_pct_change = df['涨跌幅'].iat[-1]
+        last_turnover = df['换手率'].iat[-1]
         
         # 价格过滤 5.0 - 20.0
         if not (5.0 <= last_close <= 20.0):
             return None
 
-        # 计算指标
-        df['MA5'] = df['收盘'].rolling(window=5).mean()
-        df['MA20'] = df['收盘'].rolling(window=20).mean()
-        df['MA60'] = df['收盘'].rolling(window=60).mean()
-        df['MA120'] = df['收盘'].rolling(window=120).mean()
-        df['VOL_MA5'] = df['成交量'].rolling(window=5).mean()
-        df['VOL_MA20'] = df['成交量'].rolling(window=20).mean()
+        # 计算指标：均线只用到最新一日，直接对尾部求均值（按 float64 累加，与 rolling 一致），不新增整列
+        ma20, ma60, ma120 = (close[-n:].mean(dtype=np.float64) for n in (20, 60, 120))
+        vol_ma5, vol_ma20 = (vol[-n:].mean(dtype=np.float64) for n in (5, 20))
 
         # 战法逻辑判定
         # 1. 均线支撑：股价在60日和120日线上方
-        is_bull_trend = last_close > df['MA60'].iloc[-1] and last_close > df['MA120'].iloc[-1]
+        is_bull_trend = last_close > ma60 and last_close > ma120
         
         # 2. 缩量洗盘判定：前5日内有低地量
-        recent_vols = df['成交量'].iloc[-6:-1]
-        has_low_vol = any(recent_vols < df['VOL_MA20'].iloc[-1] * 0.7)
+        has_low_vol = (vol[-6:-1] < vol_ma20 * 0.7).any()
         
         # 3. 今日放量确认：成交量是5日均量的1.5倍以上
-        vol_breakout = last_vol > df['VOL_MA5'].iloc[-1] * 1.5
+        vol_breakout = last_vol > vol_ma5 * 1.5
         
         # 4. 涨幅过滤：主板强势但不宜过早封死或大幅跳空，设定为 3% - 10.5%
         is_price_ok = 3.0 <= last_pct_change <= 10.5
@@ -70,8 +103,8 @@ def analyze_stock(file_path, name_map):
         if is_bull_trend and has_low_vol and is_price_ok and vol_breakout:
             # 信号强度评分
             score = 0
-            if last_close > df['MA20'].iloc[-1]: score += 1
-            if last_vol > df['VOL_MA20'].iloc[-1] * 2: score += 2
+            if last_close > ma20: score += 1
+            if last_vol > vol_ma20 * 2: score += 2
             if last_turnover < 15: score += 2
             
             strength = f"{score} 级"
@@ -84,7 +117,7 @@ def analyze_stock(file_path, name_map):
             # 历史回测简单逻辑：计算未来3天的最高涨幅（此处为展示，实战需后验数据）
             # 仅作为模拟，输出当前筛选结果
             return {
-                "日期": df['日期'].iloc[-1],
+                "日期": df['日期'].iat[-1],
                 "代码": code,
                 "名称": name,
                 "收盘价": last_close,
@@ -93,32 +126,34 @@ def analyze_stock(file_path, name_map):
                 "信号强度": strength,
                 "操作建议": suggestion
             }
-    except Exception as e:
+    except (ValueError, KeyError, IndexError) as e:
+        logging.warning("跳过 %s: %s", code, e)
         return None
     return None
 
 def main():
     # 加载名称映射
-    name_df = pd.read_csv(NAMES_FILE)
-    name_df['code'] = name_df['code'].astype(str).str.zfill(6)
-    name_map = dict(zip(name_df['code'], name_df['name']))
+    name_map = load_names(NAMES_FILE)
 
     # 并行扫描 CSV
-    files = glob.glob(os.path.join(DATA_DIR, "*.csv"))
-    results = []
+    files = list_csv(DATA_DIR)
     
-    with concurrent.futures.ProcessPoolExecutor() as executor:
-        future_to_stock = {executor.submit(analyze_stock, f, name_map): f for f in files}
-        for future in concurrent.futures.as_completed(future_to_stock):
-            res = future.result()
-            if res:
-                results.append(res)
+    # 已构建缓存面板时直接切片扫描全市场，否则并行读取各文件
+    panel = load_panel(files)
+    if panel is not None:
+        _init_worker(name_map)
+        results = [res for res in analyze_panel(panel) if res]
+    else:
+        # 按批分发任务（与 Pool.map 的默认分块一致），减少进程间往返
+        chunksize = max(1, len(files) // ((os.cpu_count() or 1) * 4))
+        with concurrent.futures.ProcessPoolExecutor(initializer=_init_worker, initargs=(name_map,)) as executor:
+            results = [res for res in executor.map(analyze_stock, files, chunksize=chunksize) if res]
 
     # 结果处理与保存
     if results:
-        res_df = pd.DataFrame(results)
-        # 优中选优：按强度排序
-        res_df = res_df.sort_values(by="信号强度", ascending=False).head(5) 
+        # 优中选优：按强度取前 5 名（部分排序，无需对全部结果排序）；同强度按代码升序取，结果不随读取顺序变化
+        # 信号强度为 "N 级" 文本，按其中的数值排序，避免两位数强度按字符串排在个位数之后
+        res_df = pd.DataFrame(heapq.nsmallest(5, results, key=lambda x: (-int(x["信号强度"].split()[0]), x["代码"])))
         
         os.makedirs(OUTPUT_DIR_BASE, exist_ok=True)
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
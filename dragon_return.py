@@ -1,9 +1,9 @@
 import pandas as pd
 import numpy as np
 import os
-import glob
 from datetime import datetime
 from concurrent.futures import ProcessPoolExecutor
+from stock_cache import load_stock, load_names, list_csv, load_panel, iter_panel, panel_snapshot, PANEL_COLUMNS, FLOAT32_DTYPES
 
 """
 战法名称：龙头二板首阴 (Dragon Double-Board First Yin)
@@ -14,58 +14,89 @@ from concurrent.futures import ProcessPoolExecutor
 4. 买入逻辑：在洗盘阴线当日尾盘或次日缩量企稳时介入，博弈随后的缩量反包拉升。
 """
 
-def analyze_stock(file_path, names_dict):
+# 只读取战法用到的列
+READ_COLS = ['日期', '开盘', '收盘', '最高', '最低', '成交量', '涨跌幅', '换手率']
+
+# 股票名称映射，由 _init_worker 在每个工作进程（面板路径下为主进程）启动时设置一次，避免随每个任务序列化传输
+NAMES_DICT = {}
+
+def _init_worker(names_dict):
+    global NAMES_DICT
+    NAMES_DICT = names_dict
+
+def screen_code(code_raw):
+    """按代码与名称做硬性过滤，通过时返回 (代码, 名称)，否则返回 None"""
+    # 兼容性处理：提取代码中的数字部分
+    code = ''.join(filter(str.isdigit, code_raw))
+    
+    # --- 严格过滤条件 ---
+    # 1. 排除创业板(30)、科创板(68)
+    if code.startswith(('30', '68')):
+        return None
+    
+    # 名称映射的键统一为补齐6位的字符串代码，单次查找即可
+    stock_name = NAMES_DICT.get(code.zfill(6), "未知")
+    # 2. 排除 ST
+    if "ST" in str(stock_name).upper():
+        return None
+    return code, stock_name
+
+def analyze_stock(file_path):
     try:
         # 获取纯数字代码
-        code_raw = os.path.basename(file_path).replace('.csv', '')
-        # 兼容性处理：提取代码中的数字部分
-        code = ''.join(filter(str.isdigit, code_raw))
-        
-        # --- 严格过滤条件 ---
-        # 1. 排除创业板(30)、科创板(68)
-        if code.startswith(('30', '68')):
-            return None
-        
-        stock_name = names_dict.get(code, names_dict.get(int(code) if code.isdigit() else "", "未知"))
-        # 2. 排除 ST
-        if "ST" in str(stock_name).upper():
+        passed = screen_code(os.path.basename(file_path).replace('.csv', ''))
+        if passed is None:
             return None
+        df = load_stock(file_path, columns=READ_COLS, dtype=FLOAT32_DTYPES)
+    except Exception:
+        return None
+    return analyze_frame(*passed, df)
+
+def analyze_panel(panel):
+    """在全市场面板上按 offsets 切片逐只判定，无需逐个打开文件"""
+    # 先在最新一日快照上过滤行数与价格，只对幸存者切片读取历史
+    snap = panel_snapshot(panel)
+    snap = snap[(snap['rows'] >= 5) & snap['close'].between(5.0, 20.0)]
+    results = []
+    for code_raw, a in iter_panel(panel, [PANEL_COLUMNS[c] for c in READ_COLS], only=set(snap['code'])):
+        passed = screen_code(code_raw)
+        if passed is not None:
+            results.append(analyze_frame(*passed, pd.DataFrame({c: a[PANEL_COLUMNS[c]] for c in READ_COLS})))
+    return results
 
-        df = pd.read_csv(file_path)
+def analyze_frame(code, stock_name, df):
+    """对通过代码过滤的单只股票日线数据执行战法判定"""
+    try:
         if len(df) < 5: return None
         
-        # 统一列名处理（防止CSV编码或空格导致读取失败）
-        df.columns = [c.strip() for c in df.columns]
-        df = df.sort_values('日期')
+        # 缓存与面板已按日期升序存放，仅在回退读取未排序的 CSV 时才排序
+        if not df['日期'].is_monotonic_increasing:
+            df = df.sort_values('日期')
         
         # 3. 价格过滤 (最新收盘价在 5-20 元)
-        last_price = df.iloc[-1]['收盘']
+        last_price = df['收盘'].iat[-1]
         if not (5.0 <= last_price <= 20.0):
             return None
 
         # --- 战法核心筛选逻辑 ---
-        # 获取最近4天数据用于判断：前前前(T-3), 前前(T-2), 前(T-1), 今(T)
-        data = df.tail(4)
-        if len(data) < 4: return None
-        
-        t0 = data.iloc[-1]  # 今日 (首阴日)
-        t1 = data.iloc[-2]  # 昨日 (二连板)
-        t2 = data.iloc[-3]  # 前日 (一连板)
+        # 取最近3天数组按位置判断：前日(T-2, 一连板), 昨日(T-1, 二连板), 今日(T, 首阴日)
+        o, c, h, l, pct, vol = (df[col].to_numpy()[-3:] for col in ('开盘', '收盘', '最高', '最低', '涨跌幅', '成交量'))
+        t0_turnover = df['换手率'].iat[-1]
         
         # A. 判断二连板 (涨幅 > 9.5%)
-        is_double_board = (t1['涨跌幅'] >= 9.5) and (t2['涨跌幅'] >= 9.5)
+        is_double_board = (pct[-2] >= 9.5) and (pct[-3] >= 9.5)
         if not is_double_board:
             return None
 
         # B. 判断是否为首阴 (今日收盘 < 开盘 或 涨跌幅 < 0)
-        is_yin = t0['收盘'] < t0['开盘'] or t0['涨跌幅'] < 0
+        is_yin = c[-1] < o[-1] or pct[-1] < 0
         if not is_yin:
             return None
 
         # C. 核心：不回补缺口 (今日最低价 > T-2日的最高价/收盘价)
         # 缺口支撑是判断真假洗盘的关键
-        gap_price = t2['收盘']
-        is_gap_safe = t0['最低'] > gap_price
+        gap_price = c[-3]
+        is_gap_safe = l[-1] > gap_price
         if not is_gap_safe:
             return None
 
@@ -74,12 +105,12 @@ def analyze_stock(file_path, names_dict):
         details = []
 
         # 1. 强度项：二板是一字板 (开=收=高=低)
-        if t1['开盘'] == t1['收盘'] == t1['最高']:
+        if o[-2] == c[-2] == h[-2]:
             score += 25
             details.append("二板一字极致强势")
         
         # 2. 成交量项：首阴放量 (放量说明换手充分)
-        vol_ratio = t0['成交量'] / t1['成交量']
+        vol_ratio = vol[-1] / vol[-2]
         if vol_ratio > 1.8:
             score += 15
             details.append("巨量洗盘换手充分")
@@ -88,10 +119,10 @@ def analyze_stock(file_path, names_dict):
             details.append("缩量阴线动力不足")
 
         # 3. 换手率项
-        if 5 <= t0['换手率'] <= 15:
+        if 5 <= t0_turnover <= 15:
             score += 10
             details.append("换手率适中")
-        elif t0['换手率'] > 25:
+        elif t0_turnover > 25:
             score -= 20
             details.append("换手过高警惕出货")
 
@@ -109,10 +140,11 @@ def analyze_stock(file_path, names_dict):
         return {
             "代码": code,
             "名称": stock_name,
-            "最新价": last_price,
-            "今日涨跌": f"{t0['涨跌幅']}%",
-            "换手率": t0['换手率'],
-            "量比": round(vol_ratio, 2),
+            # 价量数据为 float32，转回 Python 浮点并按源数据精度（2位小数）输出，避免 CSV 中出现 float32 的尾数
+            "最新价": round(float(last_price), 2),
+            "今日涨跌": f"{round(float(pct[-1]), 2)}%",
+            "换手率": round(float(t0_turnover), 2),
+            "量比": round(float(vol_ratio), 2),
             "评分": score,
             "信号等级": signal_type,
             "复盘分析": " / ".join(details),
@@ -125,24 +157,24 @@ def analyze_stock(file_path, names_dict):
 def main():
     # 1. 加载代码映射表
     try:
-        names_df = pd.read_csv('stock_names.csv')
-        # 确保代码是字符串且补齐6位
-        names_df['code'] = names_df['code'].astype(str).str.zfill(6)
-        names_dict = dict(zip(names_df['code'], names_df['name']))
+        names_dict = load_names()
     except:
         names_dict = {}
 
     # 2. 扫描数据并并行筛选
-    stock_files = glob.glob('stock_data/*.csv')
+    stock_files = list_csv('stock_data')
     print(f"开始分析，共计 {len(stock_files)} 只股票...")
     
-    results = []
-    with ProcessPoolExecutor() as executor:
-        futures = [executor.submit(analyze_stock, f, names_dict) for f in stock_files]
-        for future in futures:
-            res = future.result()
-            if res:
-                results.append(res)
+    # 已构建缓存面板时直接切片扫描全市场，否则并行读取各文件
+    panel = load_panel(stock_files)
+    if panel is not None:
+        _init_worker(names_dict)
+        results = [res for res in analyze_panel(panel) if res]
+    else:
+        # 按批分发任务（与 Pool.map 的默认分块一致），减少进程间往返
+        chunksize = max(1, len(stock_files) // ((os.cpu_count() or 1) * 4))
+        with ProcessPoolExecutor(initializer=_init_worker, initargs=(names_dict,)) as executor:
+            results = [res for res in executor.map(analyze_stock, stock_files, chunksize=chunksize) if res]
     
     # 3. 输出结果
     if results:
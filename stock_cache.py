@@ -0,0 +1,182 @@
+import os
+import numpy as np
+import pandas as pd
+
+# ==========================================
+# 日线数据本地缓存
+# 1. 将 stock_data/*.csv 预解析为 pickle（按日期升序存放），存放于 stock_cache/。
+# 2. 战法脚本通过 load_stock 读取：缓存比 CSV 新则直接读缓存，否则回退解析 CSV。
+# 3. 同时生成全市场面板 stock_cache/panel/：各列首尾相接存为连续数组，
+#    配合 offsets 按股票切片，读取时内存映射，免去逐个打开文件。
+# 4. 股票名称映射同样缓存为 stock_cache/stock_names.pkl，load_names 在缓存不早于 CSV 时直接读取。
+# 5. 数据更新后重新运行本脚本即可，只重建过期的文件。
+# 6. 各战法的 GitHub Actions 工作流在运行脚本前先执行本脚本（stock_cache/ 不入库），缺少缓存时脚本仍可逐个读取 CSV。
+# 7. 另提供多个战法共用的指标计算 rsi_last。
+# ==========================================
+
+DATA_DIR = "stock_data"
+NAMES_FILE = "stock_names.csv"
+CACHE_DIR = "stock_cache"
+PANEL_DIR = os.path.join(CACHE_DIR, "panel")
+PANEL_COLUMNS = {
+    '日期': 'date', '开盘': 'open', '收盘': 'close', '最高': 'high', '最低': 'low',
+    '成交量': 'volume', '成交额': 'amount', '振幅': 'amplitude', '涨跌幅': 'pct_chg',
+    '涨跌额': 'change', '换手率': 'turnover'
+}
+# 价格、成交量、涨跌幅等列用 float32 已足够精确；成交额数值过大，保留 float64
+FLOAT32_DTYPES = {c: np.float32 for c in ['开盘', '收盘', '最高', '最低', '成交量', '振幅', '涨跌幅', '涨跌额', '换手率']}
+
+def load_names(path=NAMES_FILE):
+    """读取股票名称映射 {6位代码: 名称}；代码按文本读取并补齐6位，各战法统一按字符串代码查找"""
+    pkl_path = cache_path(path)
+    if is_fresh(path, pkl_path):
+        return pd.read_pickle(pkl_path)
+    names = pd.read_csv(path, dtype={'code': str})
+    codes = np.char.zfill(names['code'].to_numpy(dtype=str), 6)
+    return dict(zip(codes.tolist(), names['name'].tolist()))
+
+def list_csv(data_dir=DATA_DIR):
+    """列出数据目录下全部 CSV 的路径；os.scandir 遍历时直接给出文件名，无需 glob 逐项匹配"""
+    return [entry.path for entry in os.scandir(data_dir) if entry.name.endswith('.csv')]
+
+def cache_path(csv_path):
+    code = os.path.basename(csv_path).replace('.csv', '')
+    return os.path.join(CACHE_DIR, f"{code}.pkl")
+
+def is_fresh(csv_path, pkl_path):
+    """缓存文件存在且不早于源 CSV 的修改时间"""
+    return os.path.exists(pkl_path) and os.path.getmtime(pkl_path) >= os.path.getmtime(csv_path)
+
+def load_stock(csv_path, columns=None, dtype=None):
+    """读取单只股票日线数据，优先命中缓存；dtype 为 {列名: 类型}，如 FLOAT32_DTYPES"""
+    pkl_path = cache_path(csv_path)
+    if is_fresh(csv_path, pkl_path):
+        df = pd.read_pickle(pkl_path)
+        if columns is not None:
+            df = df[columns]
+        if dtype is not None:
+            df = df.astype({c: t for c, t in dtype.items() if c in df.columns})
+        return df
+    df = pd.read_csv(csv_path, usecols=columns, dtype=dtype)
+    return df if columns is None else df[columns]
+
+def tail_row(csv_path, block=512):
+    """只读 CSV 的表头与末尾一块，返回最后一行 {列名: 文本}；无数据行时返回 None
+    用于读取全文件之前按最新一日的价格等条件预筛。
+    """
+    with open(csv_path, 'rb') as f:
+        header = f.readline()
+        size = f.seek(0, os.SEEK_END)
+        f.seek(max(size - block, len(header)))
+        lines = [line for line in f.read().splitlines() if line.strip()]
+    if not lines:
+        return None
+    columns = header.decode('utf-8-sig').strip().split(',')
+    return dict(zip(columns, lines[-1].decode('utf-8').split(',')))
+
+def panel_is_fresh(files):
+    """面板覆盖的股票与 CSV 一致，且不早于其中任何一个 CSV"""
+    codes_path = os.path.join(PANEL_DIR, "codes.npy")
+    if not os.path.exists(codes_path) or not files:
+        return False
+    codes = np.load(codes_path)
+    if sorted(codes.tolist()) != sorted(os.path.basename(f).replace('.csv', '') for f in files):
+        return False
+    return os.path.getmtime(codes_path) >= max(os.path.getmtime(f) for f in files)
+
+def load_panel(files=None):
+    """读取全市场面板，返回 (codes, offsets, columns)；面板缺失或过期时返回 None
+    第 i 只股票的数据为 columns[col][offsets[i]:offsets[i+1]]，按日期升序。
+    """
+    if files is None:
+        files = list_csv()
+    if not panel_is_fresh(files):
+        return None
+    codes = np.load(os.path.join(PANEL_DIR, "codes.npy"))
+    offsets = np.load(os.path.join(PANEL_DIR, "offsets.npy"))
+    columns = {col: np.load(os.path.join(PANEL_DIR, f"{col}.npy"), mmap_mode='r') for col in PANEL_COLUMNS.values()}
+    return codes, offsets, columns
+
+def iter_panel(panel, columns=None, only=None):
+    """逐只股票产出 (code, {列名: 数组视图})，列名取 PANEL_COLUMNS 中的英文名；跳过无数据的股票
+    only 为代码集合时只产出其中的股票（通常取自 panel_snapshot 的预筛结果）。
+    """
+    codes, offsets, cols = panel
+    names = list(cols) if columns is None else columns
+    for i, code in enumerate(codes):
+        start, end = offsets[i], offsets[i+1]
+        code = str(code)
+        if end > start and (only is None or code in only):
+            yield code, {c: cols[c][start:end] for c in names}
+
+def panel_snapshot(panel):
+    """全市场最新一日快照：每只股票一行，含历史行数、最新一日各列及前一日收盘/成交量
+    各战法先在快照上向量化过滤价格、换手等末日条件，只对幸存者切片读取历史。
+    """
+    codes, offsets, cols = panel
+    rows = np.diff(offsets)
+    has = rows > 0
+    last = offsets[1:][has] - 1
+    # 只有一行数据时前一日取自身
+    prev = np.maximum(last - 1, offsets[:-1][has])
+    snap = pd.DataFrame({'code': codes[has].astype(str), 'rows': rows[has]})
+    for col in ('open', 'close', 'high', 'low', 'volume', 'amplitude', 'pct_chg', 'turnover'):
+        snap[col] = cols[col][last]
+    snap['prev_close'] = cols['close'][prev]
+    snap['prev_volume'] = cols['volume'][prev]
+    return snap
+
+def rsi_last(close, period=14, eps=0.0):
+    """计算最新一日的RSI指标（Wilder平滑），只返回末值；数据不足 period 日时返回 NaN
+    eps 加在平均跌幅上防止除零，为 0 时无跌幅即返回 100。
+    """
+    delta = np.diff(close)
+    if len(delta) < period: return np.nan
+    gain = np.maximum(delta, 0.0)
+    loss = np.maximum(-delta, 0.0)
+    # Wilder平滑 avg = (avg*(n-1)+x)/n 的展开式：以前period日均值为种子，之后各日按几何权重衰减
+    decay = (period - 1) / period
+    weights = decay ** np.arange(len(delta) - period - 1, -1, -1) / period
+    seed_weight = decay ** (len(delta) - period)
+    avg_gain = gain[:period].mean() * seed_weight + gain[period:] @ weights
+    avg_loss = loss[:period].mean() * seed_weight + loss[period:] @ weights + eps
+    if avg_loss == 0: return 100.0
+    return 100 - (100 / (1 + avg_gain / avg_loss))
+
+def build_panel(files):
+    os.makedirs(PANEL_DIR, exist_ok=True)
+    frames = [load_stock(f).sort_values('日期', kind='stable') for f in files]
+    codes = np.array([os.path.basename(f).replace('.csv', '') for f in files])
+    offsets = np.concatenate(([0], np.cumsum([len(df) for df in frames])))
+    for src, col in PANEL_COLUMNS.items():
+        values = np.concatenate([df[src].to_numpy() for df in frames])
+        if col == 'date':
+            values = values.astype(str)
+        elif src in FLOAT32_DTYPES:
+            values = values.astype(np.float32)
+        np.save(os.path.join(PANEL_DIR, f"{col}.npy"), values)
+    np.save(os.path.join(PANEL_DIR, "offsets.npy"), offsets)
+    # codes 最后写入，其修改时间作为整个面板的新鲜度标记
+    np.save(os.path.join(PANEL_DIR, "codes.npy"), codes)
+
+def build_cache():
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    files = list_csv()
+    built = 0
+    for f in files:
+        pkl_path = cache_path(f)
+        if is_fresh(f, pkl_path):
+            continue
+        pd.read_csv(f).sort_values('日期', kind='stable').reset_index(drop=True).to_pickle(pkl_path)
+        built += 1
+    print(f"缓存更新完成：共 {len(files)} 个文件，本次重建 {built} 个。")
+    
+    if os.path.exists(NAMES_FILE) and not is_fresh(NAMES_FILE, cache_path(NAMES_FILE)):
+        pd.to_pickle(load_names(), cache_path(NAMES_FILE))
+    
+    if files and not panel_is_fresh(files):
+        build_panel(sorted(files))
+        print(f"全市场面板已重建：{PANEL_DIR}")
+
+if __name__ == "__main__":
+    build_cache()
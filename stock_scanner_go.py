@@ -1,11 +1,14 @@
 import pandas as pd
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 from datetime import datetime
 import os
+import logging
+import pickle
 import pytz
-import glob
-from multiprocessing import Pool, cpu_count, Manager
+from multiprocessing import Pool, cpu_count
 import warnings
+from stock_cache import load_stock, load_names, list_csv, load_panel, iter_panel, panel_snapshot, PANEL_COLUMNS, FLOAT32_DTYPES
 
 # 忽略计算中的无关警告
 warnings.filterwarnings('ignore')
@@ -22,101 +25,155 @@ MIN_PROFIT_POTENTIAL = 15.0  # 距60日线空间
 RSI6_MAX = 25                
 RSI_WEEKLY_MAX = 35          # 周线超跌阈值
 LOOKBACK_WINDOW = 250        # 回测打分参考最近一年数据
+CALC_WINDOW = 500            # 指标只需最近500根K线：回测窗口 + EMA预热，更早的数据对最新指标的影响已低于浮点精度
 # =====================================================================
 
 SHANGHAI_TZ = pytz.timezone('Asia/Shanghai')
 STOCK_DATA_DIR = 'stock_data'
 NAME_MAP_FILE = 'stock_names.csv'
+# 只读取扫描用到的列
+READ_COLS = ['日期', '收盘', '成交量', '涨跌幅']
+
+# 股票名称映射，由 _init_worker 在每个工作进程启动时设置一次，避免随每个任务序列化传输
+NAME_MAP = {}
+
+def _init_worker(name_map):
+    global NAME_MAP
+    NAME_MAP = name_map
+
+def rolling_mean(values, window):
+    """NumPy 版 rolling(window).mean()：按 float64 累加，前 window-1 位为 NaN"""
+    out = np.full(len(values), np.nan)
+    if len(values) >= window:
+        out[window-1:] = sliding_window_view(values, window).mean(axis=1, dtype=np.float64)
+    return out
+
+def rsi(close, period):
+    """NumPy 版 RSI：涨跌幅各自滑窗求均值一次算出；首日涨跌记 0，平均跌幅为 0 时记 NaN"""
+    delta = np.diff(close, prepend=np.nan)
+    gain = rolling_mean(np.where(delta > 0, delta, 0), period)
+    loss = rolling_mean(np.where(delta < 0, -delta, 0), period)
+    loss[loss == 0] = np.nan
+    return 100 - (100 / (1 + gain / loss))
 
 def calculate_indicators(df):
     """计算日线核心指标"""
     df = df.reset_index(drop=True)
     close = df['收盘']
+    close_arr = close.to_numpy()
     
-    # 1. 均线
-    df['ma5'] = close.rolling(5).mean()
-    df['ma10'] = close.rolling(10).mean()
-    df['ma60'] = close.rolling(60).mean()
-    df['ma5_up'] = df['ma5'] >= df['ma5'].shift(1)
+    # 1. 均线：直接在原始数组上滑窗求均值，免去 rolling 对象与中间 Series 的构造（只算选股用到的 ma5/ma60）
+    df['ma5'] = rolling_mean(close_arr, 5)
+    df['ma60'] = rolling_mean(close_arr, 60)
     
     # 2. RSI6
-    delta = close.diff()
-    gain = (delta.where(delta > 0, 0)).rolling(window=6).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(window=6).mean()
-    df['rsi6'] = 100 - (100 / (1 + gain / loss.replace(0, np.nan)))
-    
-    # 3. KDJ
-    low_9 = df['最低'].rolling(9).min()
-    high_9 = df['最高'].rolling(9).max()
-    rsv = (close - low_9) / (high_9 - low_9) * 100
-    df['k_line'] = rsv.ewm(com=2).mean()
-    df['d_line'] = df['k_line'].ewm(com=2).mean()
-    df['kdj_gold'] = (df['k_line'] > df['d_line']) & (df['k_line'].shift(1) <= df['d_line'].shift(1))
+    df['rsi6'] = rsi(close_arr, 6)
     
-    # 4. MACD
-    ema12 = close.ewm(span=12, adjust=False).mean()
-    ema26 = close.ewm(span=26, adjust=False).mean()
-    df['macd_hist'] = (ema12 - ema26 - (ema12 - ema26).ewm(span=9, adjust=False).mean()) * 2
-    df['macd_improving'] = df['macd_hist'] > df['macd_hist'].shift(1)
-
-    # 5. 量能
-    df['vol_ma5'] = df['成交量'].shift(1).rolling(5).mean()
-    df['vol_ratio'] = df['成交量'] / df['vol_ma5']
+    # 3. MACD
+    # DIF 只算一次，DEA 在其上递推，柱值与"是否走强"直接在数组上得出
+    dif = close.ewm(span=12, adjust=False).mean() - close.ewm(span=26, adjust=False).mean()
+    dea = dif.ewm(span=9, adjust=False).mean()
+    hist = (dif.to_numpy() - dea.to_numpy()) * 2
+    df['macd_hist'] = hist
+    df['macd_improving'] = np.concatenate(([False], hist[1:] > hist[:-1]))
+
+    # 4. 量能
+    # vol_ma5 为前5日均量（不含当日），即滑窗均值整体后移一位
+    vol = df['成交量'].to_numpy()
+    vol_ma5 = np.concatenate(([np.nan], rolling_mean(vol, 5)[:-1]))
+    df['vol_ma5'] = vol_ma5
+    df['vol_ratio'] = vol / vol_ma5
     return df
 
 def get_weekly_resonance(df_daily):
-    """周线重采样及超跌判定"""
-    df_temp = df_daily.copy()
-    df_temp['日期'] = pd.to_datetime(df_temp['日期'])
-    df_weekly = df_temp.resample('W', on='日期').agg({'收盘': 'last'}).dropna()
+    """周线重采样及超跌判定：取每个自然周（周一至周日，同 resample('W')）最后一个收盘价，计算周线 RSI6"""
+    # 日期按升序排列；1970-01-01 为周四，天数 +3 后整除 7 即得周序号，无需 resample
+    days = df_daily['日期'].to_numpy().astype('datetime64[D]').astype(np.int64)
+    close = df_daily['收盘'].to_numpy()
+    valid = ~np.isnan(close)
+    week = (days[valid] + 3) // 7
+    close = close[valid]
+    # 周序号变化前的一天即该周最后一个交易日
+    weekly_close = close[np.append(week[1:] != week[:-1], True)]
     
-    delta = df_weekly['收盘'].diff()
-    gain = delta.where(delta > 0, 0).rolling(6).mean()
-    loss = abs(delta).rolling(6).mean()
-    df_weekly['w_rsi6'] = 100 - (100 / (1 + gain / loss.replace(0, np.nan)))
-    return df_weekly.iloc[-1]['w_rsi6']
+    # 只需最新一周的 RSI6：取最近 7 周收盘的 6 个涨跌
+    if len(weekly_close) < 7: return np.nan
+    delta = np.diff(weekly_close[-7:]).astype(np.float64)
+    gain = np.where(delta > 0, delta, 0).mean()
+    loss = np.abs(delta).mean()
+    return 100 - (100 / (1 + gain / loss)) if loss > 0 else np.nan
 
 def evaluate_stock_power(df):
     """回测历史胜率打分 (最近12个月信号表现)"""
     if len(df) < LOOKBACK_WINDOW: return 50.0
-    history = df.iloc[-LOOKBACK_WINDOW:].copy()
-    # 定义历史上的信号点
-    history['sig'] = (history['rsi6'] < 25) & (history['收盘'] > history['ma5'])
-    sig_indices = history[history['sig']].index
-    
+    close = df['收盘'].to_numpy()
+    start = len(df) - LOOKBACK_WINDOW
+    # 定义历史上的信号点：一次性生成布尔掩码，取出信号日位置
+    sig = (df['rsi6'].to_numpy()[start:] < 25) & (close[start:] > df['ma5'].to_numpy()[start:])
+    sig_indices = np.flatnonzero(sig) + start
+
     if len(sig_indices) < 2: return 50.0
-    
-    wins = 0
-    total = 0
-    for idx in sig_indices:
-        if idx + 20 < len(df): # 以20日胜率为打分标准
-            total += 1
-            if df.iloc[idx + 20]['收盘'] > df.iloc[idx]['收盘']:
-                wins += 1
-    return (wins / total * 100) if total > 0 else 50.0
-
-def process_stock(args):
-    file_path, name_map, stats_dict = args
-    stock_code = os.path.basename(file_path).split('.')[0]
-    stock_name = name_map.get(stock_code, "未知")
+
+    # 以20日胜率为打分标准，批量比较信号日与20日后的收盘价
+    sig_indices = sig_indices[sig_indices + 20 < len(df)]
+    if sig_indices.size == 0: return 50.0
+    wins = np.count_nonzero(close[sig_indices + 20] > close[sig_indices])
+    return wins / sig_indices.size * 100
+
+def screen_code(stock_code):
+    """按名称排除 ST，通过时返回股票名称，否则返回 None"""
+    stock_name = NAME_MAP.get(stock_code, "未知")
     if "ST" in stock_name.upper(): return None
+    return stock_name
+
+def process_stock(file_path):
+    stock_code = os.path.basename(file_path).split('.')[0]
+    stock_name = screen_code(stock_code)
+    if stock_name is None: return None
+
+    try:
+        # 命中本地缓存时跳过 CSV 解析，缓存过期或缺失时回退读取 CSV
+        df_raw = load_stock(file_path, columns=READ_COLS, dtype=FLOAT32_DTYPES)
+    except (OSError, EOFError, ValueError, KeyError, pickle.UnpicklingError) as e:
+        # 只跳过文件缺失/损坏、列缺失等数据问题，代码错误直接抛出
+        logging.warning("跳过 %s: %s", file_path, e)
+        return None
+    return analyze_frame(stock_code, stock_name, df_raw)
+
+def analyze_panel(panel):
+    """在全市场面板上按 offsets 切片逐只判定，无需逐个打开文件"""
+    # 先在最新一日快照上过滤行数与价格，只对幸存者切片读取最近 CALC_WINDOW 根K线
+    snap = panel_snapshot(panel)
+    snap = snap[(snap['rows'] >= 120) & (snap['close'] >= MIN_PRICE)]
+    results = []
+    for stock_code, a in iter_panel(panel, [PANEL_COLUMNS[c] for c in READ_COLS], only=set(snap['code'])):
+        stock_name = screen_code(stock_code)
+        if stock_name is not None:
+            df_raw = pd.DataFrame({c: a[PANEL_COLUMNS[c]][-CALC_WINDOW:] for c in READ_COLS})
+            results.append(analyze_frame(stock_code, stock_name, df_raw))
+    return results
 
+def analyze_frame(stock_code, stock_name, df_raw):
+    """对通过名称过滤的单只股票日线数据执行扫描判定"""
     try:
-        df_raw = pd.read_csv(file_path)
         if len(df_raw) < 120: return None
+        # 只判定最新一日，截取尾部再计算，长历史股票不必对全序列做滚动/递推
+        df_raw = df_raw.tail(CALC_WINDOW)
+        if df_raw['收盘'].isna().all(): return None
         
         df = calculate_indicators(df_raw)
-        latest = df.iloc[-1]
+        # 最新一日各指标直接取数组末位，不构造整行 Series
+        last_close, ma5, ma60, rsi6, macd_improving, vol_ratio, last_pct = (
+            df[c].to_numpy()[-1] for c in ('收盘', 'ma5', 'ma60', 'rsi6', 'macd_improving', 'vol_ratio', '涨跌幅'))
         
         # 基础过滤
-        stats_dict['total'] += 1
-        if latest['收盘'] < MIN_PRICE: return None
+        if last_close < MIN_PRICE: return None
         
-        potential = (latest['ma60'] - latest['收盘']) / latest['收盘'] * 100
+        potential = (ma60 - last_close) / last_close * 100
         
         # 判定条件
-        is_oversold_daily = latest['rsi6'] < RSI6_MAX
-        is_ignition = latest['收盘'] > latest['ma5'] and latest['macd_improving'] and latest['vol_ratio'] > MIN_VOLUME_RATIO
+        is_oversold_daily = rsi6 < RSI6_MAX
+        is_ignition = last_close > ma5 and macd_improving and vol_ratio > MIN_VOLUME_RATIO
         
         if is_oversold_daily and is_ignition:
             # 引入周线共振
@@ -140,14 +197,15 @@ def process_stock(args):
                 '等级': grade,
                 '代码': stock_code,
                 '名称': stock_name,
-                '现价': round(latest['收盘'], 2),
-                '量比': round(latest['vol_ratio'], 2),
+                '现价': round(float(last_close), 2),
+                '量比': round(vol_ratio, 2),
                 '历史胜率': f"{round(power_score, 1)}%",
                 '周线RSI': round(w_rsi6, 1),
                 '距60日线': f"{round(potential, 1)}%",
-                '今日涨跌': f"{round(latest['涨跌幅'], 1)}%"
+                '今日涨跌': f"{round(float(last_pct), 1)}%"
             }
-    except:
+    except (ValueError, KeyError, IndexError) as e:
+        logging.warning("跳过 %s: %s", stock_code, e)
         return None
     return None
 
@@ -155,26 +213,25 @@ def main():
     now = datetime.now(SHANGHAI_TZ)
     print(f"🚀 多周期潜力等级扫描仪启动... ({now.strftime('%Y-%m-%d %H:%M')})")
     
-    manager = Manager()
-    stats_dict = manager.dict({'total': 0})
-    
-    name_map = {}
-    if os.path.exists(NAME_MAP_FILE):
-        n_df = pd.read_csv(NAME_MAP_FILE, dtype={'code': str})
-        name_map = dict(zip(n_df['code'].str.zfill(6), n_df['name']))
+    name_map = load_names(NAME_MAP_FILE) if os.path.exists(NAME_MAP_FILE) else {}
 
-    files = glob.glob(os.path.join(STOCK_DATA_DIR, '*.csv'))
-    tasks = [(f, name_map, stats_dict) for f in files]
+    files = list_csv(STOCK_DATA_DIR)
 
-    with Pool(cpu_count()) as pool:
-        results = pool.map(process_stock, tasks)
-
-    valid_results = [r for r in results if r is not None]
+    # 已构建缓存面板时直接切片扫描全市场，否则并行读取各文件
+    panel = load_panel(files)
+    if panel is not None:
+        _init_worker(name_map)
+        valid_results = [r for r in analyze_panel(panel) if r is not None]
+    else:
+        # 按批分发并边到边收，主进程只保留命中的结果，不必等最慢的任务凑齐整张列表
+        chunksize = max(1, len(files) // (cpu_count() * 4))
+        with Pool(cpu_count(), initializer=_init_worker, initargs=(name_map,)) as pool:
+            valid_results = [r for r in pool.imap_unordered(process_stock, files, chunksize=chunksize) if r is not None]
     
     if valid_results:
         df_res = pd.DataFrame(valid_results)
-        # 排序：等级优先，其次是距60日线空间
-        df_res = df_res.sort_values(by=['等级', '距60日线'], ascending=[True, False])
+        # 排序：等级优先，其次是距60日线空间；最后按代码，imap_unordered 的结果顺序不定，同键的行也每次输出一致
+        df_res = df_res.sort_values(by=['等级', '距60日线', '代码'], ascending=[True, False, True])
         
         print(f"\n🎯 选出潜力标的 ({len(valid_results)} 只):")
         print(df_res.to_string(index=False))
@@ -1,10 +1,14 @@
 import pandas as pd
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import os
-import glob
+import heapq
+import logging
+import pickle
 from datetime import datetime
 import pytz
 from concurrent.futures import ProcessPoolExecutor
+from stock_cache import load_stock, load_names, list_csv, tail_row, load_panel, panel_snapshot, PANEL_COLUMNS, FLOAT32_DTYPES
 
 """
 战法名称：成交量量价擒龙战法 (实战回归+RSI风控+自适应参数版)
@@ -20,126 +24,181 @@ INPUT_DIR = 'stock_data'
 NAMES_FILE = 'stock_names.csv'
 MIN_PRICE = 5.0
 MAX_PRICE = 20.0
+# 只读取战法用到的列
+READ_COLS = ['开盘', '收盘', '成交量', '涨跌幅', '换手率']
 
-def calculate_rsi(series, period=14):
-    """计算 RSI 指标 (14日)"""
-    delta = series.diff()
-    gain = (delta.where(delta > 0, 0)).rolling(window=period).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(window=period).mean()
-    rs = gain / loss
+def calculate_rsi(close, period=14):
+    """计算最新一日的 RSI 指标 (14日)：只需最近 period 个涨跌"""
+    delta = np.diff(close[-(period + 1):])
+    gain = np.where(delta > 0, delta, 0).mean(dtype=np.float64)
+    loss = np.where(delta < 0, -delta, 0).mean(dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rs = gain / loss
     return 100 - (100 / (1 + rs))
 
 def analyze_logic(file_path):
+    # 1. 基础过滤：排除创业板(30)（按文件名中的代码，先于读取数据）
+    code = os.path.basename(file_path).replace('.csv', '').zfill(6)
+    if code.startswith('30'): return None
+    try:
+        # 先只读文件末行按最新收盘过滤价格区间，区间外的股票不必解析全文件
+        last = tail_row(file_path)
+        if last is None or not (MIN_PRICE <= np.float32(last['收盘']) <= MAX_PRICE): return None
+        df = load_stock(file_path, columns=READ_COLS, dtype=FLOAT32_DTYPES)
+    except (OSError, EOFError, ValueError, KeyError, pickle.UnpicklingError) as e:
+        # 只跳过文件缺失/损坏、列缺失等数据问题，代码错误直接抛出
+        logging.warning("跳过 %s: %s", file_path, e)
+        return None
+    return analyze_frame(code, df)
+
+def analyze_panel(panel):
+    """在全市场面板上一次性判定全部股票：四步核心逻辑只依赖最近 26 日，按 [股票, 日] 二维数组整体做布尔过滤"""
+    codes, offsets, cols = panel
+    # 先在最新一日快照上过滤代码、行数与价格
+    snap = panel_snapshot(panel)
+    keep = (snap['rows'] >= 40) & snap['close'].between(MIN_PRICE, MAX_PRICE) & ~snap['code'].str.zfill(6).str.startswith('30')
+    pos = {c: i for i, c in enumerate(codes.astype(str))}
+    ends = offsets[[pos[c] + 1 for c in snap.loc[keep, 'code']]]
+    if len(ends) == 0:
+        return []
+    # 每只股票最近 26 日（基准放量日最早为倒数第 17 日，其 10 日均量再向前看 9 日）
+    idx = ends[:, None] + np.arange(-26, 0)
+    close, open_, vol = (cols[PANEL_COLUMNS[c]][idx] for c in ('收盘', '开盘', '成交量'))
+    rows = np.arange(len(idx))
+
+    # 基准放量日：倒数第 17 至第 3 日中成交量最大者（取首个），全为空值的股票排除
+    window = vol[:, -17:-2]
+    has_vol = ~np.isnan(window).all(axis=1)
+    j = np.argmax(np.where(np.isnan(window), -np.inf, window), axis=1)
+    base_vol = window[rows, j]
+    base_vol_ma10 = sliding_window_view(vol, 10, axis=1)[rows, j].mean(axis=1, dtype=np.float64)
+    shrink_ratio = vol[:, -1] / base_vol
+    ma5_val = close[:, -5:].mean(axis=1, dtype=np.float64)
+    dist_to_ma5 = (close[:, -1] - ma5_val) / ma5_val
+
+    # A-D 四步判定（与逐只判定的提前返回条件一一对应）
+    hit = (has_vol & (base_vol > base_vol_ma10 * 1.5) & ~(shrink_ratio > 0.70)
+           & ~(close[:, -1] < open_[rows, j + 9] * 0.95) & (dist_to_ma5 >= -0.04) & (dist_to_ma5 <= 0.04))
+    hit_codes = snap.loc[keep, 'code'].to_numpy()[hit]
+    last = ends[hit] - 1
+    turnover, pct = cols[PANEL_COLUMNS['换手率']][last], cols[PANEL_COLUMNS['涨跌幅']][last]
+    return [score_signal(code.zfill(6), c[-1], o[-1], p, t, sr, d, calculate_rsi(c, 14))
+            for code, c, o, p, t, sr, d in zip(hit_codes, close[hit], open_[hit], pct, turnover, shrink_ratio[hit], dist_to_ma5[hit])]
+
+def analyze_frame(code, df):
+    """对通过代码过滤的单只股票日线数据执行战法判定"""
     try:
-        df = pd.read_csv(file_path)
         if len(df) < 40: return None
         
-        # 1. 基础过滤：排除创业板(30)和价格区间外
-        code = str(df['股票代码'].iloc[-1]).zfill(6)
-        if code.startswith('30'): return None
-        
-        last_row = df.iloc[-1]
-        last_close = last_row['收盘']
+        # 各列取出一次 NumPy 数组，最新一日数值直接按位置读取
+        close, open_, vol = (df[col].to_numpy() for col in ('收盘', '开盘', '成交量'))
+        last_close = close[-1]
         if not (MIN_PRICE <= last_close <= MAX_PRICE): return None
 
-        # 2. 指标计算
-        df['MA5'] = df['收盘'].rolling(5).mean()
-        df['MA10_Vol'] = df['成交量'].rolling(10).mean()
-        df['RSI'] = calculate_rsi(df['收盘'], 14)
-        
         # --- 四步核心逻辑 (自适应参数优化版) ---
-        # 寻找最近15日内的最大成交量作为“基准放量日” (扩大搜索深度)
-        lookback_window = df.iloc[-17:-2] 
-        if lookback_window.empty: return None
-        
-        base_vol_row = lookback_window.loc[lookback_window['成交量'].idxmax()]
-        base_vol = base_vol_row['成交量']
+        # 2. 指标只在用到的位置上计算（按 float64 累加，与 rolling 一致），不对全序列做 rolling
+        # 寻找最近15日内的最大成交量作为“基准放量日” (扩大搜索深度)，成交量全为空值时无从判定
+        if np.isnan(vol[-17:-2]).all(): return None
+        base_idx = len(df) - 17 + int(np.nanargmax(vol[-17:-2]))
+        base_vol = vol[base_idx]
+        base_vol_ma10 = vol[base_idx-9:base_idx+1].mean(dtype=np.float64)
         
         # A. 识别放量 (主力入场痕迹)
-        is_breakout = base_vol > base_vol_row['MA10_Vol'] * 1.5 # 放宽至1.5倍
+        is_breakout = base_vol > base_vol_ma10 * 1.5 # 放宽至1.5倍
         if not is_breakout: return None
         
         # B. 识别缩量 (今日成交量较基准放量萎缩 30%-70% 之间)
-        shrink_ratio = last_row['成交量'] / base_vol
+        shrink_ratio = vol[-1] / base_vol
         if shrink_ratio > 0.70: return None # 放宽至0.7
         
         # C. 价格不崩 (不低于放量日开盘价的 95%)
-        if last_close < base_vol_row['开盘'] * 0.95: return None
+        if last_close < open_[base_idx] * 0.95: return None
         
         # D. 支撑确认 (偏离 MA5 上下 4% 均视为支撑有效)
-        ma5_val = last_row['MA5']
+        ma5_val = close[-5:].mean(dtype=np.float64)
         dist_to_ma5 = (last_close - ma5_val) / ma5_val
         if not (-0.04 <= dist_to_ma5 <= 0.04): return None
 
-        # --- 全自动复盘评分与 RSI 风控系统 ---
-        score = 60 # 基础起步分
-        
-        # 细节加分项
-        if shrink_ratio < 0.35: score += 15 # 极致缩量
-        if abs(dist_to_ma5) < 0.01: score += 10 # 极准回踩
-        if last_close > last_row['开盘']: score += 10 # 收阳线信号
-        if 2 <= last_row['换手率'] <= 6: score += 5 # 适中换手
-
-        # RSI 情绪位分级与风控 (核心补全功能)
-        current_rsi = round(last_row['RSI'], 2)
-        if current_rsi >= 80:
-            risk_level = "极高（超买）"
-            risk_advice = "止盈警示：RSI超80，属于战法中的撤离区，拒绝开仓。"
-            score -= 40 # 极度危险减分
-        elif current_rsi >= 70:
-            risk_level = "偏高"
-            risk_advice = "风控提醒：高位钝化，若不放量反包则需离场。"
-        elif current_rsi <= 35:
-            risk_level = "超卖"
-            risk_advice = "观察：底背离机会，等待放量确认。"
-        else:
-            risk_level = "安全"
-            risk_advice = "买入参考：情绪位健康，符合缩量回踩逻辑。"
-
-        # 操作建议
-        if score >= 85:
-            final_advice = "【一击必中】量价逻辑完美，RSI水位极佳，重点关注。"
-        elif score >= 70:
-            final_advice = "【观察上车】符合缩量特征，回踩到位，可轻仓试探。"
-        else:
-            final_advice = "【技术备选】逻辑尚可，但动能或情绪稍欠。"
-
-        return {
-            "代码": code,
-            "评分": score,
-            "操作建议": final_advice,
-            "现价": last_close,
-            "涨跌幅": f"{last_row['涨跌幅']}%",
-            "RSI14": current_rsi,
-            "情绪水位": risk_level,
-            "买卖风控建议": risk_advice,
-            "缩量比": round(shrink_ratio, 2),
-            "距MA5距离": f"{round(dist_to_ma5*100, 2)}%"
-        }
-    except:
+        return score_signal(code, last_close, open_[-1], df['涨跌幅'].iat[-1], df['换手率'].iat[-1],
+                            shrink_ratio, dist_to_ma5, calculate_rsi(close, 14))
+    except (ValueError, KeyError, IndexError) as e:
+        logging.warning("跳过 %s: %s", code, e)
         return None
 
+def score_signal(code, last_close, last_open, last_pct, last_turnover, shrink_ratio, dist_to_ma5, rsi):
+    """全自动复盘评分与 RSI 风控系统：对已通过四步判定的股票打分并生成结果行"""
+    score = 60 # 基础起步分
+    
+    # 细节加分项
+    if shrink_ratio < 0.35: score += 15 # 极致缩量
+    if abs(dist_to_ma5) < 0.01: score += 10 # 极准回踩
+    if last_close > last_open: score += 10 # 收阳线信号
+    if 2 <= last_turnover <= 6: score += 5 # 适中换手
+
+    # RSI 情绪位分级与风控 (核心补全功能)
+    current_rsi = round(rsi, 2)
+    if current_rsi >= 80:
+        risk_level = "极高（超买）"
+        risk_advice = "止盈警示：RSI超80，属于战法中的撤离区，拒绝开仓。"
+        score -= 40 # 极度危险减分
+    elif current_rsi >= 70:
+        risk_level = "偏高"
+        risk_advice = "风控提醒：高位钝化，若不放量反包则需离场。"
+    elif current_rsi <= 35:
+        risk_level = "超卖"
+        risk_advice = "观察：底背离机会，等待放量确认。"
+    else:
+        risk_level = "安全"
+        risk_advice = "买入参考：情绪位健康，符合缩量回踩逻辑。"
+
+    # 操作建议
+    if score >= 85:
+        final_advice = "【一击必中】量价逻辑完美，RSI水位极佳，重点关注。"
+    elif score >= 70:
+        final_advice = "【观察上车】符合缩量特征，回踩到位，可轻仓试探。"
+    else:
+        final_advice = "【技术备选】逻辑尚可，但动能或情绪稍欠。"
+
+    return {
+        "代码": code,
+        "评分": score,
+        "操作建议": final_advice,
+        "现价": last_close,
+        "涨跌幅": f"{round(float(last_pct), 2)}%",
+        "RSI14": current_rsi,
+        "情绪水位": risk_level,
+        "买卖风控建议": risk_advice,
+        "缩量比": round(shrink_ratio, 2),
+        "距MA5距离": f"{round(float(dist_to_ma5) * 100, 2)}%"
+    }
+
 def main():
-    files = glob.glob(os.path.join(INPUT_DIR, "*.csv"))
-    # 加载名称
-    names_df = pd.read_csv(NAMES_FILE, dtype={'code': str})
-    names_df = names_df[~names_df['name'].str.contains("ST|退")]
-    valid_codes = set(names_df['code'].tolist())
+    files = list_csv(INPUT_DIR)
+    # 加载名称：{代码: 名称} 映射（代码补齐6位，与结果中的代码一致），命中结果直接按键查找
+    names = pd.Series(load_names(NAMES_FILE))
+    # 排除ST及退市股：两次纯子串查找，不走正则
+    name_map = names[~(names.str.contains('ST', regex=False, na=False) | names.str.contains('退', regex=False, na=False))].to_dict()
 
-    results = []
-    # 并行处理
-    with ProcessPoolExecutor() as executor:
-        for res in executor.map(analyze_logic, files):
-            if res and res['代码'] in valid_codes:
-                res['名称'] = names_df[names_df['code'] == res['代码']]['name'].values[0]
-                results.append(res)
+    # 已构建缓存面板时直接切片扫描全市场，否则并行读取各文件
+    panel = load_panel(files)
+    if panel is not None:
+        hits = analyze_panel(panel)
+    else:
+        # 并行处理，按批分发任务（与 Pool.map 的默认分块一致），减少进程间往返
+        chunksize = max(1, len(files) // ((os.cpu_count() or 1) * 4))
+        with ProcessPoolExecutor() as executor:
+            hits = list(executor.map(analyze_logic, files, chunksize=chunksize))
 
-    # 按评分降序排列
-    results = sorted(results, key=lambda x: x['评分'], reverse=True)
+    results = []
+    for res in hits:
+        if res and res['代码'] in name_map:
+            res['名称'] = name_map[res['代码']]
+            results.append(res)
 
     if results:
-        # 只保留最精华的前 15 名
-        df_final = pd.DataFrame(results[:15])
+        # 只保留最精华的前 15 名：按评分降序部分排序，同分按代码升序取；
+        # 面板与逐个读取文件两条路径的结果顺序不同，也选出同一批股票
+        df_final = pd.DataFrame(heapq.nsmallest(15, results, key=lambda x: (-x['评分'], x['代码'])))
         
         # 动态创建文件夹
         tz = pytz.timezone('Asia/Shanghai')
@@ -1,8 +1,12 @@
 import os
+import heapq
+import logging
+import pickle
 import pandas as pd
 import numpy as np
 from datetime import datetime
 from concurrent.futures import ProcessPoolExecutor
+from stock_cache import load_stock, load_names, list_csv, tail_row, load_panel, iter_panel, panel_snapshot, PANEL_COLUMNS, FLOAT32_DTYPES
 
 # ==========================================
 # 战法名称：周线缩量双拐战法 (Weekly Double-Turn)
@@ -16,94 +20,157 @@ from concurrent.futures import ProcessPoolExecutor
 DATA_DIR = './stock_data'
 NAMES_FILE = './stock_names.csv'
 OUTPUT_BASE = './results'
+# 只读取战法用到的列
+READ_COLS = ['日期', '股票代码', '收盘', '成交量', '涨跌幅']
+# 周线判定用到的列（面板中按文件名记录代码，无股票代码列）
+WEEKLY_COLS = ['日期', '收盘', '成交量', '涨跌幅']
 
-def analyze_stock(file_path, stock_names_df):
+# 股票名称映射，由 _init_worker 在每个工作进程启动时设置一次，避免随每个任务序列化传输
+NAMES_DICT = {}
+
+def _init_worker(names_dict):
+    global NAMES_DICT
+    NAMES_DICT = names_dict
+
+def weekly_bars(dates, close, vol, pct):
+    """NumPy 版 resample('W')：按自然周（周一至周日）聚合为周收盘、周成交量、周涨跌幅
+    与 resample 一致，首尾之间没有交易日的周也保留一行：收盘为 NaN，成交量与涨跌幅为 0。
+    """
+    days = dates.astype('datetime64[D]').astype(np.int64)
+    if (np.diff(days) < 0).any():
+        order = np.argsort(days, kind='stable')
+        days, close, vol, pct = days[order], close[order], vol[order], pct[order]
+    # 1970-01-01 为周四，天数 +3 后整除 7 即得周序号
+    week = (days + 3) // 7
+    week -= week[0]
+    n_weeks = week[-1] + 1
+    
+    # 周收盘取该周最后一个有效收盘价
+    valid = ~np.isnan(close)
+    week_valid, close_valid = week[valid], close[valid]
+    # 周序号变化前的一天即该周最后一个交易日
+    last = np.append(week_valid[1:] != week_valid[:-1], True)
+    w_close = np.full(n_weeks, np.nan, dtype=close.dtype)
+    w_close[week_valid[last]] = close_valid[last]
+    # 求和列沿用原列的 float32，NaN 按 0 计
+    w_vol = np.bincount(week, weights=np.nan_to_num(vol), minlength=n_weeks).astype(vol.dtype)
+    w_pct = np.bincount(week, weights=np.nan_to_num(pct), minlength=n_weeks).astype(pct.dtype)
+    return w_close, w_vol, w_pct
+
+def analyze_stock(file_path):
+    # 先按文件名中的代码排除创业板，再只读文件末行过滤价格区间，多数股票不必解析全文件
+    if os.path.basename(file_path).startswith('30'):
+        return None
     try:
-        df = pd.read_csv(file_path)
+        last = tail_row(file_path)
+        if last is None or not (5.0 <= np.float32(last['收盘']) <= 20.0):
+            return None
+        
+        # 命中本地缓存时跳过 CSV 解析，缓存过期或缺失时回退读取 CSV
+        df = load_stock(file_path, columns=READ_COLS, dtype=FLOAT32_DTYPES)
         if df.empty or len(df) < 60:
             return None
         
         # 基础过滤：代码格式与板块
-        code = str(df['股票代码'].iloc[-1]).zfill(6)
+        code = str(df['股票代码'].to_numpy()[-1]).zfill(6)
         if code.startswith('30') or code.startswith('ST') or code.startswith('*ST'):
             return None
-        
+    except (OSError, EOFError, ValueError, KeyError, IndexError, pickle.UnpicklingError) as e:
+        # 只跳过文件缺失/损坏、列缺失等数据问题，代码错误直接抛出
+        logging.warning("跳过 %s: %s", file_path, e)
+        return None
+    return analyze_frame(code, df)
+
+def analyze_panel(panel):
+    """在全市场面板上按 offsets 切片逐只判定，无需逐个打开文件"""
+    # 先在最新一日快照上过滤行数、价格与板块，只对幸存者切片读取历史
+    snap = panel_snapshot(panel)
+    snap = snap[(snap['rows'] >= 60) & snap['close'].between(5.0, 20.0) & ~snap['code'].str.zfill(6).str.startswith('30')]
+    return [
+        analyze_frame(code.zfill(6), pd.DataFrame({c: a[PANEL_COLUMNS[c]] for c in WEEKLY_COLS}))
+        for code, a in iter_panel(panel, [PANEL_COLUMNS[c] for c in WEEKLY_COLS], only=set(snap['code']))
+    ]
+
+def analyze_frame(code, df):
+    """对通过板块过滤的单只股票日线数据执行周线判定"""
+    try:
         # 价格区间过滤 (5.0 - 20.0)
-        last_close = df['收盘'].iloc[-1]
+        last_close = df['收盘'].to_numpy()[-1]
         if not (5.0 <= last_close <= 20.0):
             return None
 
-        # 计算周线数据 (将日线重采样为周线)
-        df['日期'] = pd.to_datetime(df['日期'])
-        df.set_index('日期', inplace=True)
-        
-        logic = {
-            '开盘': 'first', '收盘': 'last', '最高': 'max', 
-            '最低': 'min', '成交量': 'sum', '涨跌幅': 'sum'
-        }
-        w_df = df.resample('W').apply(logic)
+        # 计算周线数据 (将日线聚合为周线)
+        w_close, w_vol, w_pct = weekly_bars(df['日期'].to_numpy(), df['收盘'].to_numpy(),
+                                            df['成交量'].to_numpy(), df['涨跌幅'].to_numpy())
         
-        # 计算技术指标
-        w_df['MA60'] = w_df['收盘'].rolling(window=60).mean()
-        w_df['MA20'] = w_df['收盘'].rolling(window=20).mean()
-        w_df['V_MA5'] = w_df['成交量'].rolling(window=5).mean()
-        
-        # MACD 计算
-        exp1 = w_df['收盘'].ewm(span=12, adjust=False).mean()
-        exp2 = w_df['收盘'].ewm(span=26, adjust=False).mean()
-        w_df['DIF'] = exp1 - exp2
-        w_df['DEA'] = w_df['DIF'].ewm(span=9, adjust=False).mean()
+        # 计算技术指标：只用到最新两周，直接在数组尾部求值
+        # MA60 要求窗口内 60 周收盘齐全（含空周 NaN 时无值）
+        ma60 = w_close[-60:].mean(dtype=np.float64) if len(w_close) >= 60 else np.nan
+        v_ma5 = w_vol[-5:].mean(dtype=np.float64) if len(w_vol) >= 5 else np.nan
 
         # --- 战法核心筛选逻辑 ---
         # 1. 趋势：MA60 走平或向上
-        trend_ok = w_df['MA60'].iloc[-1] >= w_df['MA60'].iloc[-2]
+        # 相邻两周的 MA60 窗口只差首尾各一周，MA60[-1] >= MA60[-2] 等价于本周收盘不低于 60 周前收盘
+        trend_ok = len(w_close) >= 61 and not np.isnan(w_close[-61:]).any() and w_close[-1] >= w_close[-61]
         
         # 2. 缩量：当前周成交量小于 5周均量的 0.6倍 (极致缩量)
-        vol_shrink = w_df['成交量'].iloc[-1] < w_df['V_MA5'].iloc[-1] * 0.6
+        vol_shrink = w_vol[-1] < v_ma5 * 0.6
+        
+        price_support = w_close[-1] >= ma60 * 0.98 # 在支撑位附近
+        if not (trend_ok and vol_shrink and price_support):
+            return None
         
         # 3. 双拐：DIF 向上拐头 且 价格企稳（或DIF金叉DEA）
-        macd_turn = w_df['DIF'].iloc[-1] > w_df['DIF'].iloc[-2]
-        price_support = w_df['收盘'].iloc[-1] >= w_df['MA60'].iloc[-1] * 0.98 # 在支撑位附近
+        # MACD 只对通过前三项的少数股票计算
+        w_close_s = pd.Series(w_close)
+        dif = (w_close_s.ewm(span=12, adjust=False).mean() - w_close_s.ewm(span=26, adjust=False).mean()).to_numpy()
+        dea = pd.Series(dif).ewm(span=9, adjust=False).mean().to_numpy()
+        macd_turn = dif[-1] > dif[-2]
         
         if trend_ok and vol_shrink and macd_turn and price_support:
             # 计算信号强度 (0-100)
             strength = 0
             if vol_shrink: strength += 40
-            if w_df['DIF'].iloc[-1] > w_df['DEA'].iloc[-1]: strength += 30
-            if w_df['涨跌幅'].iloc[-1] > 0: strength += 30
+            if dif[-1] > dea[-1]: strength += 30
+            if w_pct[-1] > 0: strength += 30
             
             # 操作建议逻辑
             suggestion = "观察待定"
             if strength >= 80: suggestion = "重点关注：一击必中，分批建仓"
             elif strength >= 60: suggestion = "轻仓试错：趋势初步确认"
             
-            name = stock_names_df.get(code, "未知名称")
+            name = NAMES_DICT.get(code, "未知名称")
             return {
                 '代码': code, '名称': name, '现价': last_close,
                 '信号强度': strength, '操作建议': suggestion,
-                '周成交量比': round(w_df['成交量'].iloc[-1] / w_df['V_MA5'].iloc[-1], 2)
+                '周成交量比': round(w_vol[-1] / v_ma5, 2)
             }
-    except Exception as e:
+    except (ValueError, KeyError, IndexError) as e:
+        # 日期无法解析等数据问题
+        logging.warning("跳过 %s: %s", code, e)
         return None
 
 def run_parallel():
     # 加载股票名称
-    names_df = pd.read_csv(NAMES_FILE)
-    names_dict = dict(zip(names_df['code'].astype(str).str.zfill(6), names_df['name']))
+    names_dict = load_names(NAMES_FILE)
     
-    files = [os.path.join(DATA_DIR, f) for f in os.listdir(DATA_DIR) if f.endswith('.csv')]
+    files = list_csv(DATA_DIR)
     
-    results = []
-    with ProcessPoolExecutor() as executor:
-        future_results = [executor.submit(analyze_stock, f, names_dict) for f in files]
-        for future in future_results:
-            res = future.result()
-            if res: results.append(res)
+    # 已构建缓存面板时直接切片扫描全市场，否则并行读取各文件
+    panel = load_panel(files)
+    if panel is not None:
+        _init_worker(names_dict)
+        results = [res for res in analyze_panel(panel) if res]
+    else:
+        # 按批分发任务（与 Pool.map 的默认分块一致），减少进程间往返
+        chunksize = max(1, len(files) // ((os.cpu_count() or 1) * 4))
+        with ProcessPoolExecutor(initializer=_init_worker, initargs=(names_dict,)) as executor:
+            results = [res for res in executor.map(analyze_stock, files, chunksize=chunksize) if res]
     
     if results:
-        final_df = pd.DataFrame(results).sort_values(by='信号强度', ascending=False)
-        # 优中选优：只取前 5 名最强信号
-        final_df = final_df.head(5)
+        # 优中选优：只取前 5 名最强信号（部分排序，无需对全部结果排序），同强度按代码升序取；
+        # 面板与逐个读取文件两条路径的结果顺序不同，也选出同一批股票
+        final_df = pd.DataFrame(heapq.nsmallest(5, results, key=lambda x: (-x['信号强度'], x['代码'])))
         
         # 创建年月目录
         now = datetime.now()